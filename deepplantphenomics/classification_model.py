@@ -5,7 +5,6 @@ import os
 import datetime
 import time
 import warnings
-import copy
 from tqdm import tqdm
 
 
@@ -31,14 +30,15 @@ class ClassificationModel(DPPModel):
 
         # Summaries specific to classification problems
         tf.summary.scalar('train/accuracy', self._graph_ops['accuracy'], collections=['custom_summaries'])
-        tf.summary.histogram('train/class_predictions', self.__class_predictions, collections=['custom_summaries'])
+        tf.summary.histogram('train/class_predictions', self.__class_predictions,
+                             collections=['custom_expensive_summaries'])
         if self._validation:
             tf.summary.scalar('validation/accuracy', self._graph_ops['val_accuracy'],
                               collections=['custom_summaries'])
             tf.summary.histogram('validation/class_predictions', self.__val_class_predictions,
-                                 collections=['custom_summaries'])
+                                 collections=['custom_expensive_summaries'])
 
-        self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_merge_summaries()
 
     def _assemble_graph(self):
         with self._graph.as_default():
@@ -50,11 +50,11 @@ class ClassificationModel(DPPModel):
                 self._graph_parse_data()
 
                 # Batch the datasets and create iterators for them
-                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True)
+                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True, images=True, augment=True)
                 if self._testing:
-                    test_iter = self._batch_and_iterate(self._test_dataset)
+                    test_iter = self._batch_and_iterate(self._test_dataset, images=True)
                 if self._validation:
-                    val_iter = self._batch_and_iterate(self._val_dataset)
+                    val_iter = self._batch_and_iterate(self._val_dataset, images=True)
 
                 if self._has_moderation:
                     train_mod_iter = self._batch_and_iterate(self._train_moderation_features)
@@ -183,8 +183,7 @@ class ClassificationModel(DPPModel):
         elapsed = time.time() - start_time
 
         if train_writer is not None:
-            summary = self._session.run(self._graph_ops['merged'])
-            train_writer.add_summary(summary, batch_num)
+            self._write_summaries(batch_num, train_writer)
 
         if self._validation:
             loss, epoch_accuracy, epoch_val_accuracy = self._session.run([self._graph_ops['cost'],
@@ -303,7 +302,7 @@ class ClassificationModel(DPPModel):
             num_out = output_size
 
         with self._graph.as_default():
-            layer = layers.fullyConnectedLayer('output', copy.deepcopy(self._last_layer().output_size), num_out,
+            layer = layers.fullyConnectedLayer('output', self._last_layer_output_size(), num_out,
                                                reshape, None, self._weight_initializer, regularization_coefficient)
 
         self._log('Inputs: {0} Outputs: {1}'.format(layer.input_size, layer.output_size))
@@ -322,8 +321,7 @@ class ClassificationModel(DPPModel):
         labels = np.array([])
 
         for sd in subdirs:
-            image_paths = [os.path.join(sd, name) for name in os.listdir(sd) if
-                           os.path.isfile(os.path.join(sd, name)) & name.endswith('.png')]
+            image_paths = loaders.get_dir_files(sd, suffix='.png')
             image_files = image_files + image_paths
 
             # for one-hot labels
@@ -30,7 +30,7 @@ class CountCeptionModel(DPPModel):
             tf.summary.scalar('validation/accuracy', self._graph_ops['val_accuracy'],
                               collections=['custom_summaries'])
 
-        self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_merge_summaries()
 
     def _assemble_graph(self):
         with self._graph.as_default():
@@ -41,11 +41,11 @@ class CountCeptionModel(DPPModel):
                 self._graph_parse_data()
 
                 # Batch the datasets and create iterators for them
-                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True)
+                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True, images=True, augment=True)
                 if self._testing:
-                    test_iter = self._batch_and_iterate(self._test_dataset)
+                    test_iter = self._batch_and_iterate(self._test_dataset, images=True)
                 if self._validation:
-                    val_iter = self._batch_and_iterate(self._val_dataset)
+                    val_iter = self._batch_and_iterate(self._val_dataset, images=True)
 
             # Create an optimizer object for all of the devices
             optimizer = self._graph_make_optimizer()
@@ -154,8 +154,7 @@ class CountCeptionModel(DPPModel):
         elapsed = time.time() - start_time
 
         if train_writer is not None:
-            summary = self._session.run(self._graph_ops['merged'])
-            train_writer.add_summary(summary, batch_num)
+            self._write_summaries(batch_num, train_writer)
 
         if self._validation:
             loss, epoch_accuracy, epoch_val_accuracy = self._session.run([self._graph_ops['cost'],
@@ -264,11 +263,13 @@ class CountCeptionModel(DPPModel):
 
     def _parse_read_images(self, images, channels=1, image_type=tf.float32):
         # With Countception, we can have either strings from an inference forward pass, or straight arrays from a
-        # pickle file during training.
+        # pickle file during training. The pickled arrays are already floats, so they're kept as float32 rather than
+        # being quantized to a smaller image_type. image_type is only kept to match DPPModel's signature; this override
+        # ignores it, and images read from strings are always float32 as well.
         if images.dtype == tf.string:
             images = super()._parse_read_images(images, channels)
         else:
-            images = tf.image.convert_image_dtype(images, dtype=image_type)
+            images = tf.image.convert_image_dtype(images, dtype=tf.float32)
         return images
 
     def load_countception_dataset_from_pkl_file(self, pkl_file_name):
@@ -8,13 +8,37 @@ import json
 import datetime
 import time
 import warnings
-import copy
 import math
 import random
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
 from tqdm import tqdm
 
 
+def _require_positive_int(name, value):
+    """Raise an error for setter arguments that aren't positive ints"""
+    if not isinstance(value, int):
+        raise TypeError(name + " must be an int")
+    if value <= 0:
+        raise ValueError(name + " must be positive")
+
+
+def _require_positive_float(name, value):
+    """Raise an error for setter arguments that aren't positive floats"""
+    if not isinstance(value, float):
+        raise TypeError(name + " must be a float")
+    if value <= 0:
+        raise ValueError(name + " must be positive")
+
+
+def _require_unit_float(name, value):
+    """Raise an error for setter arguments that aren't either a float in [0, 1] or exactly 0"""
+    if not isinstance(value, float) and value != 0:
+        raise TypeError(name + " must be a float or 0")
+    if value < 0 or value > 1:
+        raise ValueError(name + " must be between 0 and 1")
+
+
 class DPPModel(ABC):
     """
     The DPPModel class represents a model which can either be trained, or loaded from an existing checkpoint file. It
@@ -24,6 +48,13 @@ class DPPModel(ABC):
     # Class variables with the supported implementations for various network components; subclasses should override
     # these
     _supported_optimizers = ['adam', 'adagrad', 'adadelta', 'sgd', 'sgd_momentum']
+    # Display names and constructors (given a learning rate) for each of the supported optimizers
+    _optimizer_factories = {'adam': ('Adam', lambda lr: tf.train.AdamOptimizer(lr)),
+                            'adagrad': ('Adagrad', lambda lr: tf.train.AdagradOptimizer(lr)),
+                            'adadelta': ('Adadelta', lambda lr: tf.train.AdadeltaOptimizer(lr)),
+                            'sgd': ('SGD', lambda lr: tf.train.GradientDescentOptimizer(lr)),
+                            'sgd_momentum': ('SGD with momentum',
+                                             lambda lr: tf.train.MomentumOptimizer(lr, 0.9, use_nesterov=True))}
     _supported_weight_initializers = ['normal', 'xavier']
     _supported_activation_functions = ['relu', 'tanh', 'lrelu', 'selu']
     _supported_pooling_types = ['max', 'avg']
@@ -79,6 +110,9 @@ class DPPModel(ABC):
 
         self._crop_or_pad_images = False
         self._resize_images = False
+        self._jpeg_dct_method = 'INTEGER_FAST'
+        self._cache_images = False
+        self._cache_dir = None
 
         # Augmentation options
         self._augmentation_flip_horizontal = False
@@ -169,6 +203,7 @@ class DPPModel(ABC):
         self._load_from_saved = load_from_saved
         self._tb_dir = tensorboard_dir
         self._report_rate = report_rate
+        self._expensive_summary_rate = report_rate * 10
 
         # Multi-threading and GPU
         self._num_threads = 1
@@ -199,11 +234,16 @@ class DPPModel(ABC):
         return self._layers[-1]
 
     def _last_layer_outputs_volume(self):
-        return isinstance(self._last_layer().output_size, (list,))
+        return isinstance(self._last_layer().output_size, list)
+
+    def _last_layer_output_size(self):
+        # Output sizes are either an int or a flat list of ints, so a shallow copy is all that's needed to protect them
+        output_size = self._last_layer().output_size
+        return list(output_size) if isinstance(output_size, list) else output_size
 
     def _first_layer(self):
-        return next(layer for layer in self._layers if
-                    isinstance(layer, layers.convLayer) or isinstance(layer, layers.fullyConnectedLayer))
+        return next(layer for layer in self._layers
+                    if isinstance(layer, (layers.convLayer, layers.fullyConnectedLayer)))
 
     def _reset_session(self):
         self._session = tf.Session(graph=self._graph,
@@ -214,10 +254,7 @@ class DPPModel(ABC):
 
     def set_number_of_threads(self, num_threads):
         """Set number of threads for preprocessing tasks"""
-        if not isinstance(num_threads, int):
-            raise TypeError("num_threads must be an int")
-        if num_threads <= 0:
-            raise ValueError("num_threads must be positive")
+        _require_positive_int("num_threads", num_threads)
 
         self._num_threads = num_threads
 
@@ -225,10 +262,7 @@ class DPPModel(ABC):
         """Set the number of GPUs to use for graph evaluation. Setting this higher than the number of available GPUs
         has the same effect as setting this to exactly that amount (i.e. setting this to 4 with 2 GPUs available will
         still only use 2 GPUs)."""
-        if not isinstance(num_gpus, int):
-            raise TypeError("num_gpus must be an int")
-        if num_gpus <= 0:
-            raise ValueError("num_gpus must be positive")
+        _require_positive_int("num_gpus", num_gpus)
 
         if self._max_gpus != 0:
             self._num_gpus = num_gpus if (num_gpus <= self._max_gpus) else self._max_gpus
@@ -257,10 +291,7 @@ class DPPModel(ABC):
 
     def set_batch_size(self, size):
         """Set the batch size"""
-        if not isinstance(size, int):
-            raise TypeError("size must be an int")
-        if size <= 0:
-            raise ValueError("size must be positive")
+        _require_positive_int("size", size)
 
         self._batch_size = size
 
@@ -272,10 +303,7 @@ class DPPModel(ABC):
 
     def set_test_split(self, ratio):
         """Set a ratio for the total number of samples to use as a testing set"""
-        if not isinstance(ratio, float) and ratio != 0:
-            raise TypeError("ratio must be a float or 0")
-        if ratio < 0 or ratio > 1:
-            raise ValueError("ratio must be between 0 and 1")
+        _require_unit_float("ratio", ratio)
 
         if ratio == 0 or ratio is None:
             self._testing = False
@@ -290,10 +318,7 @@ class DPPModel(ABC):
 
     def set_validation_split(self, ratio):
         """Set a ratio for the total number of samples to use as a validation set"""
-        if not isinstance(ratio, float) and ratio != 0:
-            raise TypeError("ratio must be a float or 0")
-        if ratio < 0 or ratio > 1:
-            raise ValueError("ratio must be between 0 and 1")
+        _require_unit_float("ratio", ratio)
 
         if ratio == 0 or ratio is None:
             self._validation = False
@@ -320,19 +345,13 @@ class DPPModel(ABC):
 
     def set_maximum_training_epochs(self, epochs):
         """Set the max number of training epochs"""
-        if not isinstance(epochs, int):
-            raise TypeError("epochs must be an int")
-        if epochs <= 0:
-            raise ValueError("epochs must be positive")
+        _require_positive_int("epochs", epochs)
 
         self._maximum_training_batches = epochs
 
     def set_learning_rate(self, rate):
         """Set the initial learning rate"""
-        if not isinstance(rate, float):
-            raise TypeError("rate must be a float")
-        if rate <= 0:
-            raise ValueError("rate must be positive")
+        _require_positive_float("rate", rate)
 
         self._learning_rate = rate
 
@@ -350,6 +369,38 @@ class DPPModel(ABC):
 
         self._resize_images = resize
 
+    def set_jpeg_decode_method(self, method):
+        """
+        Set the IDCT method used when decoding JPEG images. 'fast' is quicker to decode, while 'accurate' gives
+        slightly more faithful pixel values at the cost of decoding speed.
+        :param method: Either 'fast' or 'accurate'
+        """
+        if not isinstance(method, str):
+            raise TypeError("method must be a str")
+        dct_methods = {'fast': 'INTEGER_FAST', 'accurate': 'INTEGER_ACCURATE'}
+        method = method.lower()
+        if method not in dct_methods:
+            raise ValueError("'" + method + "' is not a supported JPEG decode method. Choose one of " +
+                             " ".join("'" + x + "'" for x in dct_methods))
+
+        self._jpeg_dct_method = dct_methods[method]
+
+    def set_image_caching(self, cache, cache_dir=None):
+        """
+        Cache images after they're decoded and resized so they're only read from disk once. Random augmentations are
+        applied after the cache, so they still change every epoch.
+        :param cache: A flag for whether to cache images
+        :param cache_dir: An optional directory to write the cache to for datasets that don't fit in memory. The cache
+        files are reused by later runs, so they should be deleted if the dataset changes.
+        """
+        if not isinstance(cache, bool):
+            raise TypeError("cache must be a bool")
+        if cache_dir is not None and not isinstance(cache_dir, str):
+            raise TypeError("cache_dir must be a str")
+
+        self._cache_images = cache
+        self._cache_dir = cache_dir
+
     def set_augmentation_flip_horizontal(self, flip):
         """Randomly flip training images horizontally"""
         if not isinstance(flip, bool):
@@ -405,23 +456,14 @@ class DPPModel(ABC):
 
     def set_regularization_coefficient(self, lamb):
         """Set lambda for L2 weight decay"""
-        if not isinstance(lamb, float):
-            raise TypeError("lamb must be a float")
-        if lamb <= 0:
-            raise ValueError("lamb must be positive")
+        _require_positive_float("lamb", lamb)
 
         self._reg_coeff = lamb
 
     def set_learning_rate_decay(self, decay_factor, batches_per_decay):
         """Set learning rate decay"""
-        if not isinstance(decay_factor, float):
-            raise TypeError("decay_factor must be a float")
-        if decay_factor <= 0:
-            raise ValueError("decay_factor must be positive")
-        if not isinstance(batches_per_decay, int):
-            raise TypeError("epochs_per_day must be an int")
-        if batches_per_decay <= 0:
-            raise ValueError("epochs_per_day must be positive")
+        _require_positive_float("decay_factor", decay_factor)
+        _require_positive_int("batches_per_decay", batches_per_decay)
 
         self._lr_decay_factor = decay_factor
         self._lr_decay_epochs = batches_per_decay
@@ -602,24 +644,12 @@ class DPPModel(ABC):
 
     def _graph_make_optimizer(self):
         """Generate a new optimizer object for computing and applying gradients"""
-        if self._optimizer == 'adagrad':
-            self._log('Using Adagrad optimizer')
-            return tf.train.AdagradOptimizer(self._learning_rate)
-        elif self._optimizer == 'adadelta':
-            self._log('Using Adadelta optimizer')
-            return tf.train.AdadeltaOptimizer(self._learning_rate)
-        elif self._optimizer == 'sgd':
-            self._log('Using SGD optimizer')
-            return tf.train.GradientDescentOptimizer(self._learning_rate)
-        elif self._optimizer == 'adam':
-            self._log('Using Adam optimizer')
-            return tf.train.AdamOptimizer(self._learning_rate)
-        elif self._optimizer == 'sgd_momentum':
-            self._log('Using SGD with momentum optimizer')
-            return tf.train.MomentumOptimizer(self._learning_rate, 0.9, use_nesterov=True)
-        else:
-            warnings.warn('Unrecognized optimizer requested')
-            exit()
+        if self._optimizer not in self._optimizer_factories:
+            raise ValueError("Unrecognized optimizer requested: '" + str(self._optimizer) + "'")
+
+        name, make_optimizer = self._optimizer_factories[self._optimizer]
+        self._log('Using ' + name + ' optimizer')
+        return make_optimizer(self._learning_rate)
 
     def _graph_get_gradients(self, loss, optimizer):
         """
@@ -628,7 +658,8 @@ class DPPModel(ABC):
         :param optimizer: The optimizer object used to generate the gradients
         :return: The graph's gradients, variables, and the global gradient norm from clipping
         """
-        gradients, variables = zip(*optimizer.compute_gradients(loss))
+        # Computing each gradient on the same device as its forward op keeps gradients on their GPU until clipping
+        gradients, variables = zip(*optimizer.compute_gradients(loss, colocate_gradients_with_ops=True))
         gradients, global_grad_norm = tf.clip_by_global_norm(gradients, 5.0)
         return gradients, variables, global_grad_norm
 
@@ -694,17 +725,25 @@ class DPPModel(ABC):
         """
         self._log('Creating Tensorboard summaries...')
 
+        # Scalar summaries are cheap and go in 'custom_summaries', which is written at every report. Histograms and
+        # images pull whole tensors back from the device, so they go in 'custom_expensive_summaries', which is written
+        # less often.
+
         # Summaries for any problem type
         tf.summary.scalar('train/loss', self._graph_ops['cost'], collections=['custom_summaries'])
         tf.summary.scalar('train/learning_rate', self._learning_rate, collections=['custom_summaries'])
         tf.summary.scalar('train/l2_loss', l2_cost, collections=['custom_summaries'])
         filter_summary = self._get_weights_as_image(self._first_layer().weights)
-        tf.summary.image('filters/first', filter_summary, collections=['custom_summaries'])
+        tf.summary.image('filters/first', filter_summary, collections=['custom_expensive_summaries'])
+
+        expensive_collections = ['custom_expensive_summaries']
+        unbiased_layer_types = (layers.convLayer, layers.upsampleLayer)
+        skipped_layer_types = (layers.batchNormLayer, layers.copyConnection, layers.skipConnection)
 
         def _add_layer_histograms(net_layer):
-            tf.summary.histogram('weights/' + net_layer.name, net_layer.weights, collections=['custom_summaries'])
-            if not ((isinstance(net_layer, layers.convLayer) or isinstance(net_layer, layers.upsampleLayer)) and net_layer.use_bias is False):
-                tf.summary.histogram('biases/' + net_layer.name, net_layer.biases, collections=['custom_summaries'])
+            tf.summary.histogram('weights/' + net_layer.name, net_layer.weights, collections=expensive_collections)
+            if not (isinstance(net_layer, unbiased_layer_types) and net_layer.use_bias is False):
+                tf.summary.histogram('biases/' + net_layer.name, net_layer.biases, collections=expensive_collections)
 
             # At one point the graph would hang on session.run(graph_ops['merged']) inside of begin_training
             # and it was found that if you commented the below line then the code wouldn't hang. Never
@@ -712,7 +751,7 @@ class DPPModel(ABC):
             # validation. But after adding more features and just randomly trying to uncomment the below
             # line to see if it would work, it appears to now be working, but still don't know why...
             tf.summary.histogram('activations/' + net_layer.name, net_layer.activations,
-                                 collections=['custom_summaries'])
+                                 collections=expensive_collections)
 
         # Summaries for each net_layer
         for layer in self._layers:
@@ -720,8 +759,7 @@ class DPPModel(ABC):
                 if isinstance(layer, layers.paralConvBlock):
                     _add_layer_histograms(layer.conv1)
                     _add_layer_histograms(layer.conv2)
-                elif not isinstance(layer, layers.batchNormLayer) and not isinstance(layer, layers.copyConnection) \
-                        and not isinstance(layer, layers.skipConnection):
+                elif not isinstance(layer, skipped_layer_types):
                     _add_layer_histograms(layer)
 
         # Summaries for gradients
@@ -732,9 +770,10 @@ class DPPModel(ABC):
         if not self._hyper_param_search:
             for index, grad in enumerate(gradients):
                 tf.summary.histogram("gradients/" + variables[index].name[:-2], gradients[index],
-                                     collections=['custom_summaries'])
+                                     collections=['custom_expensive_summaries'])
 
-            tf.summary.histogram("gradient_global_norm/", global_grad_norm, collections=['custom_summaries'])
+            tf.summary.histogram("gradient_global_norm/", global_grad_norm,
+                                 collections=['custom_expensive_summaries'])
 
     def _graph_tensorboard_summary(self, l2_cost, gradients, variables, global_grad_norm):
         """
@@ -744,7 +783,31 @@ class DPPModel(ABC):
         :param global_grad_norm: ...
         """
         self._graph_tensorboard_common_summary(l2_cost, gradients, variables, global_grad_norm)
+        self._graph_merge_summaries()
+
+    def _graph_merge_summaries(self):
+        """Merges the cheap and the expensive Tensorboard summaries into separate ops"""
         self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_ops['merged_expensive'] = tf.summary.merge_all(key='custom_expensive_summaries')
+
+    def _write_summaries(self, batch_num, train_writer):
+        """
+        Writes the Tensorboard summaries for a batch. The expensive summaries are only written every
+        `_expensive_summary_rate` batches, as well as for the first and last reported batches so that even short runs
+        get them.
+        :param batch_num: The batch number to write the summaries for
+        :param train_writer: A `tf.summary.FileWriter` for writing Tensorboard log files
+        """
+        first_report = batch_num <= self._report_rate
+        last_report = batch_num + self._report_rate >= self._maximum_training_batches
+        write_expensive = first_report or last_report or batch_num % self._expensive_summary_rate == 0
+
+        summary_ops = [self._graph_ops['merged']]
+        if write_expensive and self._graph_ops.get('merged_expensive') is not None:
+            summary_ops.append(self._graph_ops['merged_expensive'])
+
+        for summary in self._session.run(summary_ops):
+            train_writer.add_summary(summary, batch_num)
 
     @abstractmethod
     def _assemble_graph(self):
@@ -757,19 +820,33 @@ class DPPModel(ABC):
         """
         pass
 
-    def _batch_and_iterate(self, dataset, shuffle=False):
+    def _batch_and_iterate(self, dataset, shuffle=False, images=False, augment=False):
         """
         Sets up batching and prefetching for a Dataset, with optional shuffling (for training), and returns an iterator
         for the final Dataset.
         :param dataset: The Dataset to prepare with batching and prefetching
         :param shuffle: A flag for whether to shuffle the Dataset items
+        :param images: A flag for whether the Dataset holds (image, label) pairs, whose images get converted to floats
+        and mean-centered a whole batch at a time
+        :param augment: A flag for whether to apply the training augmentations to the batches of images
         :return: A one-shot iterator for the prepared Dataset
         """
         if shuffle:
             dataset = dataset.shuffle(10000)
         dataset = dataset.batch(self._subbatch_size)
+        if images:
+            dataset = dataset.map(lambda x, y: (self._parse_batch_images(x, augment), y),
+                                  num_parallel_calls=self._num_threads)
         dataset = dataset.repeat()
-        dataset = dataset.prefetch(self._num_gpus)
+        # Let tf.data size the prefetch buffer so input preparation overlaps with training steps
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+        # Have tf.data merge chains of map stages into single functions and run any remaining sequential ones in
+        # parallel; map and batch fusion is already on by default
+        options = tf.data.Options()
+        options.experimental_optimization.map_fusion = True
+        options.experimental_optimization.map_parallelization = True
+        dataset = dataset.with_options(options)
         data_iter = dataset.make_one_shot_iterator()
         return data_iter
 
@@ -785,8 +862,7 @@ class DPPModel(ABC):
         elapsed = time.time() - start_time
 
         if train_writer is not None:
-            summary = self._session.run(self._graph_ops['merged'])
-            train_writer.add_summary(summary, batch_num)
+            self._write_summaries(batch_num, train_writer)
 
         if self._validation:
             loss, epoch_test_loss = self._session.run([self._graph_ops['cost'], self._graph_ops['val_cost']])
@@ -888,78 +964,127 @@ class DPPModel(ABC):
                 else:
                     return
 
-    def begin_training_with_hyperparameter_search(self, l2_reg_limits=None, lr_limits=None, num_steps=3):
+    def begin_training_with_hyperparameter_search(self, l2_reg_limits=None, lr_limits=None, num_steps=3,
+                                                  search_strategy='grid', num_trials=9, patience=None):
         """
-        Performs grid-based hyper-parameter search given the ranges passed. Parameters are optional.
+        Performs hyper-parameter search given the ranges passed. Parameters are optional.
 
         :param l2_reg_limits: array representing a range of L2 regularization coefficients in the form [low, high]
         :param lr_limits: array representing a range of learning rates in the form [low, high]
-        :param num_steps: the size of the grid. Larger numbers are exponentially slower.
-        """
+        :param num_steps: the size of the grid. Larger numbers are exponentially slower. Only used for grid search.
+        :param search_strategy: either 'grid', to try every combination of evenly spaced values, or 'random', to try
+        `num_trials` combinations of values sampled log-uniformly from the ranges
+        :param num_trials: the number of combinations to try with random search
+        :param patience: optionally, stop a random search early once this many runs in a row haven't improved on the
+        best loss so far
+        """
+        if search_strategy not in ['grid', 'random']:
+            raise ValueError("search_strategy must be either 'grid' or 'random'")
+        _require_positive_int("num_trials", num_trials)
+        if patience is not None:
+            if search_strategy != 'random':
+                raise ValueError("patience can only be used with random search")
+            _require_positive_int("patience", patience)
+        if search_strategy == 'random':
+            # Values are sampled on a log scale, so the limits have to be strictly positive
+            if l2_reg_limits is None and lr_limits is None:
+                raise ValueError("random search needs limits for at least one of l2_reg_limits and lr_limits")
+            for limits_name, limits in [('l2_reg_limits', l2_reg_limits), ('lr_limits', lr_limits)]:
+                if limits is not None and not 0 < limits[0] <= limits[1]:
+                    raise ValueError(limits_name + " must be [low, high] with 0 < low <= high for random search")
+
         self._hyper_param_search = True
 
         base_tb_dir = self._tb_dir
 
-        unaltered_image_height = self._image_height
-        unaltered_image_width = self._image_width
         unaltered_epochs = self._maximum_training_batches
+        unaltered_force_split = self._force_split_partition
 
-        if l2_reg_limits is None:
-            all_l2_reg = [self._reg_coeff]
-        else:
-            step_size = (l2_reg_limits[1] - l2_reg_limits[0]) / np.float32(num_steps-1)
-            all_l2_reg = np.arange(l2_reg_limits[0], l2_reg_limits[1], step_size)
-            all_l2_reg = np.append(all_l2_reg, l2_reg_limits[1])
+        if search_strategy == 'grid':
+            if l2_reg_limits is None:
+                all_l2_reg = np.array([self._reg_coeff], dtype=np.float32)
+            else:
+                all_l2_reg = np.linspace(l2_reg_limits[0], l2_reg_limits[1], num_steps, dtype=np.float32)
 
-        if lr_limits is None:
-            all_lr = [self._learning_rate]
+            if lr_limits is None:
+                all_lr = np.array([self._learning_rate], dtype=np.float32)
+            else:
+                all_lr = np.linspace(lr_limits[0], lr_limits[1], num_steps, dtype=np.float32)
+
+            all_trials = [(current_l2, current_lr) for current_l2 in all_l2_reg for current_lr in all_lr]
         else:
-            step_size = (lr_limits[1] - lr_limits[0]) / np.float32(num_steps-1)
-            all_lr = np.arange(lr_limits[0], lr_limits[1], step_size)
-            all_lr = np.append(all_lr, lr_limits[1])
+            # Learning rates and regularization coefficients span orders of magnitude, so sample their exponents
+            def _sample_log_uniform(limits, default):
+                if limits is None:
+                    return np.full(num_trials, default, dtype=np.float32)
+                return np.exp(np.random.uniform(np.log(limits[0]), np.log(limits[1]), num_trials)).astype(np.float32)
 
-        all_loss_results = np.empty([len(all_l2_reg), len(all_lr)])
+            all_trials = list(zip(_sample_log_uniform(l2_reg_limits, self._reg_coeff),
+                                  _sample_log_uniform(lr_limits, self._learning_rate)))
 
-        for i, current_l2 in enumerate(all_l2_reg):
-            for j, current_lr in enumerate(all_lr):
-                self._log('HYPERPARAMETER SEARCH: Doing l2reg=%f, lr=%f' % (current_l2, current_lr))
+        # Runs that throw an exception (or are skipped by stopping early) never write their loss, so they're left as NaN
+        all_loss_results = np.full(len(all_trials), np.nan, dtype=np.float32)
+        best_loss = np.inf
+        runs_since_best = 0
 
-                # Make a new graph, associate a new session with it.
-                self._reset_graph()
-                self._reset_session()
+        for i, (current_l2, current_lr) in enumerate(all_trials):
+            self._log('HYPERPARAMETER SEARCH: Doing l2reg=%f, lr=%f' % (current_l2, current_lr))
 
-                self._learning_rate = current_lr
-                self._reg_coeff = current_l2
+            # Make a new graph, associate a new session with it.
+            self._reset_graph()
+            self._reset_session()
 
-                # Set calculated variables back to their unaltered form
-                self._image_height = unaltered_image_height
-                self._image_width = unaltered_image_width
-                self._maximum_training_batches = unaltered_epochs
+            self._learning_rate = current_lr
+            self._reg_coeff = current_l2
 
-                # Reset the reg. coef. for all fc layers.
-                with self._graph.as_default():
-                    for layer in self._layers:
-                        if isinstance(layer, layers.fullyConnectedLayer):
-                            layer.regularization_coefficient = current_l2
+            # Set calculated variables back to their unaltered form
+            self._maximum_training_batches = unaltered_epochs
 
-                if base_tb_dir is not None:
-                    self._tb_dir = base_tb_dir + '_lr:' + current_lr.astype('str') + '_l2:' + current_l2.astype('str')
+            # Reset the reg. coef. for all fc layers.
+            with self._graph.as_default():
+                for layer in self._layers:
+                    if isinstance(layer, layers.fullyConnectedLayer):
+                        layer.regularization_coefficient = current_l2
+
+            if base_tb_dir is not None:
+                self._tb_dir = base_tb_dir + '_lr:' + current_lr.astype('str') + '_l2:' + current_l2.astype('str')
 
-                try:
-                    current_loss = self.begin_training(return_test_loss=True)
-                    all_loss_results[i][j] = current_loss
-                except Exception as e:
-                    self._log('HYPERPARAMETER SEARCH: Run threw an exception, this result will be NaN.')
-                    print("Exception message: "+str(e))
-                    all_loss_results[i][j] = np.nan
+            try:
+                current_loss = self.begin_training(return_test_loss=True)
+                all_loss_results[i] = current_loss
+            except Exception as e:
+                self._log('HYPERPARAMETER SEARCH: Run threw an exception, this result will be NaN.')
+                print("Exception message: "+str(e))
+
+            # The first run saves its partition mask, and every later run loads it instead of building a new one so
+            # that all of the runs are compared on the same split
+            self._force_split_partition = False
+
+            if patience is not None:
+                if all_loss_results[i] < best_loss:
+                    best_loss = all_loss_results[i]
+                    runs_since_best = 0
+                else:
+                    runs_since_best += 1
+                self._log('HYPERPARAMETER SEARCH: Best loss so far is %f' % best_loss)
+                if runs_since_best >= patience:
+                    self._log('HYPERPARAMETER SEARCH: No improvement in %d runs, stopping early' % patience)
+                    break
+
+        self._force_split_partition = unaltered_force_split
 
         self._log('Finished hyperparameter search, failed runs will appear as NaN.')
-        self._log('All l2 coef. tested:')
-        self._log('\n'+np.array2string(np.transpose(all_l2_reg)))
-        self._log('All learning rates tested:')
-        self._log('\n'+np.array2string(all_lr))
-        self._log('Loss/error grid:')
-        self._log('\n'+np.array2string(all_loss_results, precision=4))
+        if search_strategy == 'grid':
+            self._log('All l2 coef. tested:')
+            self._log('\n'+np.array2string(np.transpose(all_l2_reg)))
+            self._log('All learning rates tested:')
+            self._log('\n'+np.array2string(all_lr))
+            self._log('Loss/error grid:')
+            self._log('\n'+np.array2string(all_loss_results.reshape([len(all_l2_reg), len(all_lr)]), precision=4))
+        else:
+            self._log('All runs tested (l2 coef., learning rate, loss/error):')
+            for (current_l2, current_lr), current_loss in zip(all_trials, all_loss_results):
+                self._log('%f, %f, %.4f' % (current_l2, current_lr, current_loss))
 
     @abstractmethod
     def compute_full_test_accuracy(self):
@@ -1008,20 +1133,19 @@ class DPPModel(ABC):
             grid_x = 4 if grid_y_prelim % 4 == 0 else (2 if grid_y_prelim % 2 == 0 else 1)
             grid_y = grid_y_prelim // grid_x
 
-            # pack into image with proper dimensions for tf.image_summary
-            x2 = tf.transpose(x1, (3, 0, 1, 2))
-            x3 = tf.reshape(x2, tf.stack([grid_x, y * grid_y, x, num_channels]))
-            x4 = tf.transpose(x3, (0, 2, 1, 3))
-            x5 = tf.reshape(x4, tf.stack([1, x * grid_x, y * grid_y, num_channels]))
-            x6 = tf.transpose(x5, (2, 1, 3, 0))
-            x7 = tf.transpose(x6, (3, 0, 1, 2))
+            # pack into image with proper dimensions for tf.image_summary. Filter n = gx * grid_y + gy goes in grid
+            # row gy and column gx, so split the filter axis into (grid_x, grid_y) and move each next to the axis it
+            # tiles.
+            x2 = tf.reshape(x1, tf.stack([y, x, num_channels, grid_x, grid_y]))
+            x3 = tf.transpose(x2, (4, 0, 3, 1, 2))
+            x4 = tf.reshape(x3, tf.stack([1, y * grid_y, x * grid_x, num_channels]))
 
-            # scale to [0, 1]
-            x_min = tf.reduce_min(x7)
-            x_max = tf.reduce_max(x7)
-            x8 = (x7 - x_min) / (x_max - x_min)
+            # scale to [0, 1], leaving constant filters (e.g. freshly zeroed ones) at 0 rather than NaN
+            x_min = tf.reduce_min(x4)
+            x_max = tf.reduce_max(x4)
+            x5 = tf.math.divide_no_nan(x4 - x_min, x_max - x_min)
 
-        return x8
+        return x5
 
     def save_state(self, directory=None):
         """Save all trainable variables as a checkpoint in the current working path"""
@@ -1137,9 +1261,7 @@ class DPPModel(ABC):
 
         self._log('Adding the input layer...')
 
-        apply_crop = (self._augmentation_crop and self._all_images is None and self._train_images is None)
-
-        if apply_crop:
+        if self._augmentation_crop:
             size = [self._subbatch_size, int(self._image_height * self._crop_amount),
                     int(self._image_width * self._crop_amount), self._image_depth]
         else:
@@ -1162,7 +1284,7 @@ class DPPModel(ABC):
         feat_size = self._moderation_features_size
 
         with self._graph.as_default():
-            layer = layers.moderationLayer(copy.deepcopy(self._last_layer().output_size),
+            layer = layers.moderationLayer(self._last_layer_output_size(),
                                            feat_size, reshape, self._subbatch_size)
 
         self._layers.append(layer)
@@ -1232,7 +1354,7 @@ class DPPModel(ABC):
         with self._graph.as_default():
             filter_dimension[2] = self._last_layer().output_size[-1]
             layer = layers.convLayer(layer_name,
-                                     copy.deepcopy(self._last_layer().output_size),
+                                     self._last_layer_output_size(),
                                      filter_dimension,
                                      stride_length,
                                      activation_function,
@@ -1275,7 +1397,7 @@ class DPPModel(ABC):
         else:
             batch_multiplier = 1
 
-        last_layer_dims = copy.deepcopy(self._last_layer().output_size)
+        last_layer_dims = self._last_layer_output_size()
         with self._graph.as_default():
             layer = layers.upsampleLayer(layer_name,
                                          last_layer_dims,
@@ -1324,8 +1446,7 @@ class DPPModel(ABC):
         self._log('Adding pooling layer %s...' % layer_name)
 
         with self._graph.as_default():
-            layer = layers.poolingLayer(copy.deepcopy(
-                self._last_layer().output_size), kernel_size, stride_length, pooling_type)
+            layer = layers.poolingLayer(self._last_layer_output_size(), kernel_size, stride_length, pooling_type)
 
         self._log('Outputs: %s' % layer.output_size)
 
@@ -1342,7 +1463,7 @@ class DPPModel(ABC):
         self._log('Adding pooling layer %s...' % layer_name)
 
         with self._graph.as_default():
-            layer = layers.normLayer(copy.deepcopy(self._last_layer().output_size))
+            layer = layers.normLayer(self._last_layer_output_size())
 
         self._layers.append(layer)
 
@@ -1365,7 +1486,7 @@ class DPPModel(ABC):
         self._log('Adding dropout layer %s...' % layer_name)
 
         with self._graph.as_default():
-            layer = layers.dropoutLayer(copy.deepcopy(self._last_layer().output_size), p)
+            layer = layers.dropoutLayer(self._last_layer_output_size(), p)
 
         self._layers.append(layer)
 
@@ -1379,7 +1500,7 @@ class DPPModel(ABC):
         self._log('Adding batch norm layer %s...' % layer_name)
 
         with self._graph.as_default():
-            layer = layers.batchNormLayer(layer_name, copy.deepcopy(self._last_layer().output_size))
+            layer = layers.batchNormLayer(layer_name, self._last_layer_output_size())
 
         self._layers.append(layer)
 
@@ -1426,7 +1547,7 @@ class DPPModel(ABC):
             regularization_coefficient = 0.0
 
         with self._graph.as_default():
-            layer = layers.fullyConnectedLayer(layer_name, copy.deepcopy(self._last_layer().output_size), output_size,
+            layer = layers.fullyConnectedLayer(layer_name, self._last_layer_output_size(), output_size,
                                                reshape, activation_function, self._weight_initializer,
                                                regularization_coefficient)
 
@@ -1468,7 +1589,7 @@ class DPPModel(ABC):
 
         with self._graph.as_default():
             block = layers.paralConvBlock(block_name,
-                                          copy.deepcopy(self._last_layer().output_size),
+                                          self._last_layer_output_size(),
                                           filter_dimension_1,
                                           filter_dimension_2)
 
@@ -2010,8 +2131,7 @@ class DPPModel(ABC):
         if not isinstance(labels_file, str):
             raise TypeError("labels_file must be a str")
 
-        image_files = [os.path.join(dirname, name) for name in os.listdir(dirname) if
-                       os.path.isfile(os.path.join(dirname, name)) & name.endswith('.png')]
+        image_files = loaders.get_dir_files(dirname, suffix='.png')
 
         labels = loaders.read_csv_labels(labels_file, column_number)
 
@@ -2032,11 +2152,9 @@ class DPPModel(ABC):
         """
         self._resize_bbox_coords = True
 
-        images = [os.path.join(dirname, name) for name in sorted(os.listdir(dirname)) if
-                  os.path.isfile(os.path.join(dirname, name)) & name.endswith('_rgb.png')]
+        images = sorted(loaders.get_dir_files(dirname, suffix='_rgb.png'))
 
-        label_files = [os.path.join(dirname, name) for name in sorted(os.listdir(dirname)) if
-                       os.path.isfile(os.path.join(dirname, name)) & name.endswith('_bbox.csv')]
+        label_files = sorted(loaders.get_dir_files(dirname, suffix='_bbox.csv'))
 
         # currently reads columns, need to read rows instead!!!
         labels = [loaders.read_csv_rows(label_file) for label_file in label_files]
@@ -2115,22 +2233,19 @@ class DPPModel(ABC):
         test_dir = os.path.join(dirname, 'test')
         self._total_classes = 10
 
-        train_labels, train_images = loaders.read_csv_labels_and_ids(os.path.join(train_dir, 'train.txt'), 1, 0,
-                                                                     character=' ')
+        # The train and test label files are independent, so read them at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            train_read = executor.submit(loaders.read_csv_labels_and_ids, os.path.join(train_dir, 'train.txt'), 1, 0,
+                                         character=' ')
+            test_read = executor.submit(loaders.read_csv_labels_and_ids, os.path.join(test_dir, 'test.txt'), 1, 0,
+                                        character=' ')
+            train_labels, train_images = train_read.result()
+            test_labels, test_images = test_read.result()
 
-        def one_hot(labels, num_classes):
-            return [[1 if i == label else 0 for i in range(num_classes)] for label in labels]
-
-        # transform into numerical one-hot labels
-        train_labels = [int(label) for label in train_labels]
-        train_labels = one_hot(train_labels, self._total_classes)
-
-        test_labels, test_images = loaders.read_csv_labels_and_ids(os.path.join(test_dir, 'test.txt'), 1, 0,
-                                                                   character=' ')
-
-        # transform into numerical one-hot labels
-        test_labels = [int(label) for label in test_labels]
-        test_labels = one_hot(test_labels, self._total_classes)
+        # transform into numerical one-hot labels by picking out rows of an identity matrix
+        one_hot = np.eye(self._total_classes, dtype=np.float32)
+        train_labels = one_hot[np.array(train_labels, dtype=np.int64)]
+        test_labels = one_hot[np.array(test_labels, dtype=np.int64)]
 
         self._total_raw_samples = len(train_images) + len(test_images)
         self._test_split = len(test_images) / self._total_raw_samples
@@ -2138,14 +2253,16 @@ class DPPModel(ABC):
         self._log('Total raw examples is %d' % self._total_raw_samples)
         self._log('Total classes is %d' % self._total_classes)
 
-        self._raw_test_image_files = test_images
-        self._raw_train_image_files = train_images
+        # The image names are kept as arrays, like the labels, so that merging and splitting the sets below works the
+        # same way for both of them
+        self._raw_test_image_files = np.array(test_images)
+        self._raw_train_image_files = np.array(train_images)
         self._raw_test_labels = test_labels
         self._raw_train_labels = train_labels
         if not self._testing:
-            self._raw_train_image_files.extend(self._raw_test_image_files)
+            self._raw_train_image_files = np.concatenate([self._raw_train_image_files, self._raw_test_image_files])
             self._raw_test_image_files = []
-            self._raw_train_labels.extend(self._raw_test_labels)
+            self._raw_train_labels = np.concatenate([self._raw_train_labels, self._raw_test_labels])
             self._raw_test_labels = []
             self._test_split = 0
         if self._validation:
@@ -2162,24 +2279,28 @@ class DPPModel(ABC):
         """
 
         # Load all snapshot subdirectories
-        subdirs = list(filter(lambda item: os.path.isdir(item) & (item != '.DS_Store'),
-                              [os.path.join(dirname, f) for f in os.listdir(dirname)]))
-
-        image_files = []
-
-        # Load the VIS images in each subdirectory
-        for sd in subdirs:
-            image_paths = [os.path.join(sd, name) for name in os.listdir(sd) if
-                           os.path.isfile(os.path.join(sd, name)) & name.startswith('VIS_SV_')]
+        with os.scandir(dirname) as entries:
+            subdirs = [entry.path for entry in entries if entry.is_dir() and entry.name != '.DS_Store']
 
-            image_files = image_files + image_paths
+        # Load the VIS images in each subdirectory. Listing directories is mostly waiting on the file system, so the
+        # subdirectories are scanned in parallel.
+        with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+            image_files = [path for image_paths in executor.map(lambda sd: loaders.get_dir_files(sd, prefix='VIS_SV_'),
+                                                                subdirs)
+                           for path in image_paths]
 
         # Put the image files in the order of the IDs (if there are any labels loaded)
         sorted_paths = []
 
         if self._all_labels is not None:
+            # Index the images by file name so that IDs can be matched without searching through every image
+            files_by_name = self._index_files_by_name(image_files)
+
             for image_id in self._all_ids:
-                path = list(filter(lambda item: item.endswith(image_id), [p for p in image_files]))
+                path = [p for p in files_by_name.get(os.path.basename(image_id), []) if p.endswith(image_id)]
+                if not path:
+                    # IDs that are only the end of a file name still need a full search
+                    path = [p for p in image_files if p.endswith(image_id)]
                 assert len(path) == 1, 'Found no image or multiple images for %r' % image_id
                 sorted_paths.append(path[0])
         else:
@@ -2225,21 +2346,49 @@ class DPPModel(ABC):
 
         self._all_labels, self._all_ids = loaders.read_csv_multi_labels_and_ids(filepath, id_column)
 
+    def _index_files_by_name(self, file_paths):
+        """
+        Groups file paths by their file names, for matching IDs to files without searching through every path
+        :param file_paths: A list of file paths
+        :return: A dict from each file name to the list of paths with that name
+        """
+        files_by_name = {}
+        for p in file_paths:
+            files_by_name.setdefault(os.path.basename(p), []).append(p)
+        return files_by_name
+
+    def _sort_images_by_ids(self, image_files, image_ids):
+        """
+        Matches image files to IDs, which are the last part of their paths (usually just the file name)
+        :param image_files: A list of image file paths
+        :param image_ids: A list of image IDs
+        :return: The image file paths in the order of the IDs
+        """
+        # Index the images by file name so that plain file name IDs can be matched without searching through every image
+        files_by_name = self._index_files_by_name(image_files)
+
+        sorted_paths = []
+        for image_id in image_ids:
+            if '/' in image_id:
+                path = [p for p in image_files if p.endswith('/' + image_id)]
+            else:
+                path = files_by_name.get(image_id, [])
+            assert len(path) == 1, 'Found no image or multiple images for %r' % image_id
+            sorted_paths.append(path[0])
+
+        return sorted_paths
+
     def load_images_with_ids_from_directory(self, im_dir):
         """Loads images from a directory, relating them to labels by the IDs which were loaded from a CSV file"""
 
         # Load all images in directory
-        image_files = [os.path.join(im_dir, name) for name in os.listdir(im_dir) if
-                       os.path.isfile(os.path.join(im_dir, name)) & name.endswith('.png')]
+        image_files = loaders.get_dir_files(im_dir, suffix='.png')
 
         # Put the image files in the order of the IDs (if there are any labels loaded)
         sorted_paths = []
 
         if self._all_labels is not None:
-            for image_id in self._all_ids:
-                path = list(filter(lambda item: item.endswith('/' + image_id), [p for p in image_files]))
-                assert len(path) == 1, 'Found no image or multiple images for %r' % image_id
-                sorted_paths.append(path[0])
+            sorted_paths = self._sort_images_by_ids(image_files, self._all_ids)
         else:
             sorted_paths = image_files
 
@@ -2266,17 +2415,11 @@ class DPPModel(ABC):
         :param id_column_number: the column number (zero-indexed) representing the file ID
         """
 
-        image_files = [os.path.join(dirname, name) for name in os.listdir(dirname) if
-                       os.path.isfile(os.path.join(dirname, name)) & name.endswith('.png')]
+        image_files = loaders.get_dir_files(dirname, suffix='.png')
 
         labels, ids = loaders.read_csv_labels_and_ids(labels_file, column_number, id_column_number)
 
-        sorted_paths = []
-
-        for image_id in ids:
-            path = list(filter(lambda item: item.endswith('/' + image_id), [p for p in image_files]))
-            assert len(path) == 1, 'Found no image or multiple images for %r' % image_id
-            sorted_paths.append(path[0])
+        sorted_paths = self._sort_images_by_ids(image_files, ids)
 
         self._training_augmentation_images = sorted_paths
         self._training_augmentation_labels = labels
@@ -2285,23 +2428,23 @@ class DPPModel(ABC):
         """Loads single per-image bounding boxes from XML files in Pascal VOC format."""
 
         self._all_ids = []
-        self._all_labels = []
+        all_coords = []
 
-        file_paths = [os.path.join(data_dir, name) for name in os.listdir(data_dir) if
-                      os.path.isfile(os.path.join(data_dir, name)) & name.endswith('.xml')]
+        file_paths = loaders.get_dir_files(data_dir, suffix='.xml')
 
         for voc_file in file_paths:
             im_id, x_min, x_max, y_min, y_max = loaders.read_single_bounding_box_from_pascal_voc(voc_file)
+            self._all_ids.append(im_id)
+            all_coords.append([x_min, x_max, y_min, y_max])
 
-            # re-scale coordinates if images are being resized
-            if self._resize_images:
-                x_min = int(x_min * (float(self._image_width) / self._image_width_original))
-                x_max = int(x_max * (float(self._image_width) / self._image_width_original))
-                y_min = int(y_min * (float(self._image_height) / self._image_height_original))
-                y_max = int(y_max * (float(self._image_height) / self._image_height_original))
+        # re-scale coordinates if images are being resized, doing all of the boxes at once
+        if self._resize_images and all_coords:
+            width_ratio = float(self._image_width) / self._image_width_original
+            height_ratio = float(self._image_height) / self._image_height_original
+            all_coords = np.array(all_coords) * [width_ratio, width_ratio, height_ratio, height_ratio]
+            all_coords = all_coords.astype(np.int64).tolist()
 
-            self._all_ids.append(im_id)
-            self._all_labels.append([x_min, x_max, y_min, y_max])
+        self._all_labels = all_coords
 
     def load_json_labels_from_file(self, filename):
         """Loads bounding boxes for multiple images from a single json file."""
@@ -2346,13 +2489,14 @@ class DPPModel(ABC):
             self._log('Total testing samples is {0}'.format(self._total_testing_samples))
 
             # Calculate number of batches to run
-            batches_per_epoch = self._total_training_samples / float(self._batch_size)
-            self._maximum_training_batches = int(self._maximum_training_batches * batches_per_epoch)
+            # Round up so that every epoch covers all of the training samples, and keep everything in integers
+            batches_per_epoch = -(-self._total_training_samples // self._batch_size)
+            self._maximum_training_batches = self._maximum_training_batches * batches_per_epoch
 
             if self._batch_size > self._total_training_samples:
                 self._log('Less than one batch in training set, exiting now')
                 exit()
-            self._log('Batches per epoch: {:f}'.format(batches_per_epoch))
+            self._log('Batches per epoch: {0}'.format(batches_per_epoch))
             self._log('Running to {0} batches'.format(self._maximum_training_batches))
 
             # Create datasets for moderation features
@@ -2369,24 +2513,20 @@ class DPPModel(ABC):
                 self._val_moderation_features = _make_mod_features_dataset(val_mf)
 
             # Create datasets for the input data
-            self._train_dataset = self._make_input_dataset(train_images, train_labels, True)
+            self._train_dataset = self._make_input_dataset(train_images, train_labels, True, 'train')
             if self._testing:
-                self._test_dataset = self._make_input_dataset(test_images, test_labels, False)
+                self._test_dataset = self._make_input_dataset(test_images, test_labels, False, 'test')
             if self._validation:
-                self._val_dataset = self._make_input_dataset(val_images, val_labels, False)
+                self._val_dataset = self._make_input_dataset(val_images, val_labels, False, 'val')
 
-            # Set the image size to cropped values if crop augmentation was used
-            if self._augmentation_crop:
-                self._image_height = int(self._image_height * self._crop_amount)
-                self._image_width = int(self._image_width * self._crop_amount)
-
-    def _make_input_dataset(self, images, labels, train_set):
+    def _make_input_dataset(self, images, labels, train_set, split_name):
         """
         Create Tensorflow datasets and construct an input and augmentation pipeline given paired images and labels
         :param images: A list of image names for the dataset
         :param labels: The labels corresponding to the images
         :param train_set: A flag for whether this is the training dataset; certain augmentations only occur or change
         for training data specifically
+        :param split_name: The name of the dataset split, used to name its cache file if images are cached to disk
         :return: A tf.data.Dataset object that encapsulates the data input and augmentation pipeline
         """
         def _with_labels(fn):
@@ -2396,18 +2536,40 @@ class DPPModel(ABC):
         data_height = self._image_height
         data_width = self._image_width
 
-        # Create the dataset and load in the images
+        # Crops of unresized images (random for training, centred otherwise) can be taken while decoding them, so that
+        # JPEGs skip decoding the cropped-out parts. That can't happen if the decoded images are cached, since the
+        # random training crops would be cached too.
+        decode_crop = self._augmentation_crop and not self._resize_images and not self._cache_images
+
+        # Create the dataset and load in the images. Loading and resizing are done in one map stage so that each
+        # image passes through a single function instead of two separately scheduled ones.
+        def load_fn(x, y):
+            if decode_crop:
+                x = self._parse_read_crop(x, int(data_height * self._crop_amount), int(data_width * self._crop_amount),
+                                          channels=self._image_depth, random=train_set)
+                return x, y
+            x, y = self._parse_apply_preprocessing(x, y)
+            if self._resize_images:
+                x, y = self._parse_resize_images(x, y, data_height, data_width)
+            return x, y
+
         input_dataset = tf.data.Dataset.from_tensor_slices((images, labels))
-        input_dataset = input_dataset.map(self._parse_apply_preprocessing, num_parallel_calls=self._num_threads)
-        if self._resize_images:
-            input_dataset = input_dataset.map(lambda x, y: self._parse_resize_images(x, y, data_height, data_width),
-                                              num_parallel_calls=self._num_threads)
+        input_dataset = input_dataset.map(load_fn, num_parallel_calls=self._num_threads)
+
+        # Everything up to this point is deterministic, so it can be cached and skipped in later epochs
+        if self._cache_images:
+            if self._cache_dir is not None:
+                input_dataset = input_dataset.cache(os.path.join(self._cache_dir, split_name + '.cache'))
+            else:
+                input_dataset = input_dataset.cache()
 
         # Augmentations that we should do to every dataset (training, testing, and validation)
         if self._augmentation_crop:  # Apply random crops to images
             data_height = int(data_height * self._crop_amount)
             data_width = int(data_width * self._crop_amount)
-            if train_set:
+            if decode_crop:
+                pass  # The crops were already taken while loading the images
+            elif train_set:
                 input_dataset = input_dataset.map(
                     _with_labels(lambda x: tf.random_crop(x, [data_height, data_width, self._image_depth])),
                     num_parallel_calls=self._num_threads)
@@ -2415,47 +2577,24 @@ class DPPModel(ABC):
                 input_dataset = input_dataset.map(lambda x, y: self._parse_crop_or_pad(x, y, data_height, data_width),
                                                   num_parallel_calls=self._num_threads)
 
-        if self._crop_or_pad_images:  # Apply padding or cropping to deal with images of different sizes
+        # Apply padding or cropping to deal with images of different sizes. Crop augmentation already leaves every image
+        # at the final size, so this would only repeat it.
+        if self._crop_or_pad_images and not self._augmentation_crop:
             input_dataset = input_dataset.map(lambda x, y: self._parse_crop_or_pad(x, y, data_height, data_width),
                                               num_parallel_calls=self._num_threads)
 
-        if train_set:
-            # Augmentations that we should only do to the training dataset
-            if self._augmentation_flip_horizontal:  # Apply random horizontal flips
-                input_dataset = input_dataset.map(_with_labels(tf.image.random_flip_left_right),
-                                                  num_parallel_calls=self._num_threads)
-
-            if self._augmentation_flip_vertical:  # Apply random vertical flips
-                input_dataset = input_dataset.map(_with_labels(tf.image.random_flip_up_down),
-                                                  num_parallel_calls=self._num_threads)
-
-            if self._augmentation_contrast:  # Apply random contrast and brightness adjustments
-                def contrast_fn(x):
-                    x = tf.image.random_brightness(x, max_delta=63)
-                    x = tf.image.random_contrast(x, lower=0.2, upper=1.8)
-                    return x
-
-                input_dataset = input_dataset.map(_with_labels(contrast_fn), num_parallel_calls=self._num_threads)
-
-            if self._augmentation_rotate:  # Apply random rotations, then optionally border crop and resize
-                input_dataset = input_dataset.map(_with_labels(self._parse_rotate),
-                                                  num_parallel_calls=self._num_threads)
-                if self._rotate_crop_borders:
-                    crop_fraction = self._smallest_crop_fraction(data_height, data_width)
-                    input_dataset = input_dataset.map(
-                        _with_labels(lambda x: self._parse_rotation_crop(x, crop_fraction, data_height, data_width)),
-                        num_parallel_calls=self._num_threads)
-
-        # Mean-center all inputs
-        if self._supports_standardization:
-            input_dataset = input_dataset.map(_with_labels(tf.image.per_image_standardization),
-                                              num_parallel_calls=self._num_threads)
-
         # Manually set the shape of the image tensors so it matches the shape of the images
         input_dataset = input_dataset.map(
             lambda x, y: self._parse_force_set_shape(x, y, data_height, data_width, self._image_depth),
             num_parallel_calls=self._num_threads)
 
+        if train_set:
+            # Training images get shuffled anyway, so let the parallel map stages hand over whichever images finish
+            # loading first instead of waiting on slow reads to preserve the input order
+            options = tf.data.Options()
+            options.experimental_deterministic = False
+            input_dataset = input_dataset.with_options(options)
+
         return input_dataset
 
     def _parse_images(self, images):
@@ -2464,19 +2603,22 @@ class DPPModel(ABC):
         :param images: A list of image names to parse
         """
         with self._graph.as_default():
+            data_height = self._image_height
+            data_width = self._image_width
+
             input_dataset = tf.data.Dataset.from_tensor_slices(images)
             input_dataset = input_dataset.map(lambda x: self._parse_read_images(x, channels=self._image_depth),
                                               num_parallel_calls=self._num_threads)
             input_dataset = input_dataset.map(
-                lambda x: tf.image.resize_images(x, [self._image_height, self._image_width]),
+                lambda x: self._parse_resize(x, data_height, data_width),
                 num_parallel_calls=self._num_threads)
 
             if self._augmentation_crop or self._crop_or_pad_images:
                 if self._augmentation_crop:
-                    self._image_height = int(self._image_height * self._crop_amount)
-                    self._image_width = int(self._image_width * self._crop_amount)
+                    data_height = int(data_height * self._crop_amount)
+                    data_width = int(data_width * self._crop_amount)
                 input_dataset = input_dataset.map(
-                    lambda x: tf.image.resize_image_with_crop_or_pad(x, self._image_height, self._image_width),
+                    lambda x: tf.image.resize_image_with_crop_or_pad(x, data_height, data_width),
                     num_parallel_calls=self._num_threads)
 
             # Mean-center all inputs
@@ -2486,7 +2628,7 @@ class DPPModel(ABC):
 
             # Manually set the shape of the image tensors so it matches the shape of the images
             def force_set(x):
-                x.set_shape([self._image_height, self._image_width, self._image_depth])
+                x.set_shape([data_height, data_width, self._image_depth])
                 return x
 
             input_dataset = input_dataset.map(force_set, num_parallel_calls=self._num_threads)
@@ -2534,7 +2676,8 @@ class DPPModel(ABC):
         :param labels: The accompanying labels; normally passed through unchanged
         :return: The preprocessed versions of the images and the passed-through labels
         """
-        images = self._parse_read_images(images, channels=self._image_depth)
+        # Images stay as uint8 until they're resized or batched and converted in _parse_batch_images
+        images = self._parse_read_images(images, channels=self._image_depth, image_type=tf.uint8)
         return images, labels
 
     def _parse_read_images(self, images, channels=1, image_type=tf.float32):
@@ -2550,11 +2693,69 @@ class DPPModel(ABC):
         # decode_png and decode_jpeg apparently both accept JPEG and PNG. We're using one of them because decode_image
         # also accepts GIF, preventing the return of a static shape and preventing resize_images from running. See this
         # Github issue for Tensorflow: https://github.com/tensorflow/tensorflow/issues/9356
+        # decode_jpeg is used so that the IDCT method can be chosen; it's ignored for PNG images.
         images = tf.io.read_file(images)
-        images = tf.io.decode_png(images, channels=channels)
+        images = tf.io.decode_jpeg(images, channels=channels, dct_method=self._jpeg_dct_method)
         images = tf.image.convert_image_dtype(images, dtype=image_type)
         return images
 
+    def _parse_read_crop(self, images, height, width, channels=1, random=True):
+        """
+        Read in input images during dataset parsing and take a crop of them. JPEG images are cropped while they're
+        decoded, which skips decoding most of the pixels that get cropped out.
+        :param images: Strings with the names of the images to read and crop
+        :param height: The height of the crop
+        :param width: The width of the crop
+        :param channels: The number of channels in the image. Defaults to 1
+        :param random: A flag for whether to take a random crop. Otherwise, the crop is centred and images smaller than
+        it are padded, as with resize_image_with_crop_or_pad. Defaults to True
+        :return: The cropped uint8 images
+        """
+        contents = tf.io.read_file(images)
+
+        def crop_jpeg():
+            shape = tf.image.extract_jpeg_shape(contents)
+            if random:
+                offset_y = tf.random_uniform([], maxval=shape[0] - height + 1, dtype=tf.int32)
+                offset_x = tf.random_uniform([], maxval=shape[1] - width + 1, dtype=tf.int32)
+                return tf.image.decode_and_crop_jpeg(contents, [offset_y, offset_x, height, width], channels=channels,
+                                                     dct_method=self._jpeg_dct_method)
+
+            crop_height = tf.minimum(shape[0], height)
+            crop_width = tf.minimum(shape[1], width)
+            window = [(shape[0] - crop_height) // 2, (shape[1] - crop_width) // 2, crop_height, crop_width]
+            cropped = tf.image.decode_and_crop_jpeg(contents, window, channels=channels,
+                                                    dct_method=self._jpeg_dct_method)
+            return tf.image.resize_image_with_crop_or_pad(cropped, height, width)
+
+        def crop_other():
+            decoded = tf.io.decode_jpeg(contents, channels=channels, dct_method=self._jpeg_dct_method)
+            if random:
+                return tf.random_crop(decoded, [height, width, channels])
+            return tf.image.resize_image_with_crop_or_pad(decoded, height, width)
+
+        return tf.cond(tf.image.is_jpeg(contents), crop_jpeg, crop_other)
+
+    def _parse_resize(self, images, height, width, nearest=False):
+        """
+        Resize a single image tensor with half-pixel centers. The default for resize_images maps pixel corners instead,
+        which shifts the resized image by up to half a pixel.
+        :param images: The image tensor to resize
+        :param height: The new height for the image
+        :param width: The new width for the image
+        :param nearest: A flag for whether to use nearest neighbour rather than bilinear interpolation, which keeps the
+        values of label images intact
+        :return: The resized image
+        """
+        images = tf.expand_dims(images, 0)
+        if nearest:
+            images = tf.image.resize_nearest_neighbor(images, [height, width], half_pixel_centers=True)
+        else:
+            # Bilinear resizing always outputs floats, so uint8 images need to be scaled to 0-1 floats beforehand
+            images = tf.image.convert_image_dtype(images, tf.float32)
+            images = tf.image.resize_bilinear(images, [height, width], half_pixel_centers=True)
+        return images[0]
+
     def _parse_resize_images(self, images, labels, height, width):
         """
         Resize images to a consistent size during dataset parsing
@@ -2564,7 +2765,7 @@ class DPPModel(ABC):
         :param width: The new width for the images
         :return: The resized images and passed through labels
         """
-        images = tf.image.resize_images(images, [height, width])
+        images = self._parse_resize(images, height, width)
         return images, labels
 
     def _parse_crop_or_pad(self, images, labels, height, width):
@@ -2579,20 +2780,55 @@ class DPPModel(ABC):
         images = tf.image.resize_image_with_crop_or_pad(images, height, width)
         return images, labels
 
+    def _parse_batch_images(self, images, augment):
+        """
+        Converts a batch of images to floats and applies the training augmentations and mean-centering to it. Working on
+        whole batches runs each op once per batch instead of once per image, while the random values are still drawn
+        separately for each image.
+        :param images: A batch of images to process
+        :param augment: A flag for whether to apply the training augmentations
+        :return: The processed batch of images
+        """
+        # Images can be read in as uint8 and kept that way through caching, shuffling, and batching, which moves a
+        # quarter of the bytes of float images. Everything after this point needs 0-1 float images.
+        images = tf.image.convert_image_dtype(images, tf.float32)
+
+        if augment:
+            batch_shape = [tf.shape(images)[0], 1, 1, 1]
+            if self._augmentation_flip_horizontal:  # Apply random horizontal flips
+                images = tf.image.random_flip_left_right(images)
+            if self._augmentation_flip_vertical:  # Apply random vertical flips
+                images = tf.image.random_flip_up_down(images)
+            if self._augmentation_contrast:  # Apply random brightness and contrast adjustments
+                images = images + tf.random_uniform(batch_shape, -63, 63)
+                mean = tf.reduce_mean(images, axis=[1, 2], keepdims=True)
+                images = (images - mean) * tf.random_uniform(batch_shape, 0.2, 1.8) + mean
+            if self._augmentation_rotate:  # Apply random rotations, then optionally crop borders
+                images = self._parse_rotate(images)
+                if self._rotate_crop_borders:
+                    height, width = images.shape.as_list()[1:3]
+                    crop_fraction = self._smallest_crop_fraction(height, width)
+                    images = self._parse_rotation_crop(images, crop_fraction, height, width)
+
+        # Mean-center all inputs
+        if self._supports_standardization:
+            images = tf.image.per_image_standardization(images)
+        return images
+
     def _parse_rotate(self, images):
         """
-        Applies random rotation augmentation to input images during dataset parsing
+        Applies random rotation augmentation to a batch of input images during dataset parsing
         :param images: The images to rotate
         :return: The randomly rotated images
         """
-        angle = tf.random_uniform([], maxval=2 * math.pi)
-        images = tensorflow.contrib.image.rotate(images, angle, interpolation='BILINEAR')
+        angles = tf.random_uniform([tf.shape(images)[0]], maxval=2 * math.pi)
+        images = tensorflow.contrib.image.rotate(images, angles, interpolation='BILINEAR')
         return images
 
     def _parse_rotation_crop(self, images, crop_fraction, height, width):
         """
         Applies optional centre cropping for random rotation augmentation
-        :param images: Rotated images to centre crop
+        :param images: A batch of rotated images to centre crop
         :param crop_fraction: The fraction of the image to keep with the crop
         :param height: The original height to maintain after cropping the images
         :param width: The original width to maintain after cropping the images
@@ -2601,7 +2837,7 @@ class DPPModel(ABC):
         # Cropping is done using the smallest fraction possible for the image's aspect ratio to maintain a consistent
         # scale across the images
         images = tf.image.central_crop(images, crop_fraction)
-        images = tf.image.resize_images(images, [height, width])
+        images = tf.image.resize_bilinear(images, [height, width], half_pixel_centers=True)
         return images
 
     def _parse_force_set_shape(self, images, labels, height, width, depth):
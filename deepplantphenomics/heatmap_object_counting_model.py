@@ -9,7 +9,6 @@ import shutil
 from tqdm import tqdm, trange
 from PIL import Image
 import cv2
-import copy
 
 
 class HeatmapObjectCountingModel(SemanticSegmentationModel):
@@ -390,7 +389,8 @@ class HeatmapObjectCountingModel(SemanticSegmentationModel):
             for i, tl_coord, br_coord in zip(itertools.count(patch_num), patch_start, patch_end):
                 im_patch = Image.fromarray(self._autopatch_extract_patch(im, tl_coord, br_coord))
                 im_name = os.path.join(im_dir, 'im_{:0>6d}.png'.format(i))
-                im_patch.save(im_name)
+                # Patches are throwaway training data, so a low PNG compression level is worth the much faster encoding
+                im_patch.save(im_name, compress_level=1)
                 image_files.append(im_name)
 
                 label_str.append('im_{:0>6d},'.format(i) + ','.join([str(x) for x in out_labels[i]]))
@@ -410,13 +410,16 @@ class HeatmapObjectCountingModel(SemanticSegmentationModel):
         if not self.__label_from_image_file:
             # If we generated the heatmaps from points in a CSV or JSON file, then we want to treat the labels like
             # other labels, with the wrinkle that loading them requires wrapping a binary loader with tf.py_func
-            images = self._parse_read_images(images, channels=self._image_depth)
+            images = self._parse_read_images(images, channels=self._image_depth, image_type=tf.uint8)
             labels = tf.numpy_function(self._parse_load_heatmap_binary, [labels], tf.float32)
             return images, labels
         else:
-            # If we instead read in the heatmaps as images, then we want to use the version in
-            # SemanticSegmentationModel, which treats the labels like regular images.
-            return super()._parse_apply_preprocessing(images, labels)
+            # If we instead read in the heatmaps as images, then we treat the labels like regular images. Unlike in
+            # SemanticSegmentationModel, they're converted to float32 straight away since they get resized bilinearly.
+            # The input images stay uint8 until they're batched, as in every other model.
+            images = self._parse_read_images(images, channels=self._image_depth, image_type=tf.uint8)
+            labels = self._parse_read_images(labels, channels=1)
+            return images, labels
 
     def _parse_resize_images(self, images, labels, height, width):
         # See _parse_apply_preprocessing for an explanation of whats going on here
@@ -424,7 +427,10 @@ class HeatmapObjectCountingModel(SemanticSegmentationModel):
             # Skip over the version in SemanticSegmentationModel to use the one in DPPModel
             return super(SemanticSegmentationModel, self)._parse_resize_images(images, labels, height, width)
         else:
-            return super()._parse_resize_images(images, labels, height, width)
+            # Heatmaps hold continuous densities rather than class values, so they're resized bilinearly like images
+            images = self._parse_resize(images, height, width)
+            labels = self._parse_resize(labels, height, width)
+            return images, labels
 
     def _parse_crop_or_pad(self, images, labels, height, width):
         # See _parse_apply_preprocessing for an explanation of whats going on here
@@ -453,11 +459,11 @@ class HeatmapObjectCountingModel(SemanticSegmentationModel):
 
         self._log('Adding output layer...')
 
-        filter_dimension = [1, 1, copy.deepcopy(self._last_layer().output_size[3]), 1]
+        filter_dimension = [1, 1, self._last_layer().output_size[3], 1]
 
         with self._graph.as_default():
             layer = layers.convLayer('output',
-                                     copy.deepcopy(self._last_layer().output_size),
+                                     self._last_layer_output_size(),
                                      filter_dimension,
                                      1,
                                      None,
@@ -1,7 +1,6 @@
 import tensorflow.compat.v1 as tf
 import tensorflow.contrib
 import math
-import copy
 
 
 class convLayer(object):
@@ -14,7 +13,7 @@ class convLayer(object):
         self.__initializer = initializer
         self.use_bias = use_bias
         self.input_size = input_size
-        self.output_size = copy.deepcopy(input_size)
+        self.output_size = list(input_size)
         self.batch_norm_layer = None
 
         if padding is None:
@@ -287,7 +286,7 @@ class globalAveragePoolingLayer(object):
     def __init__(self, name, input_size):
         self.name = name
         self.input_size = input_size
-        self.output_size = copy.deepcopy(input_size)
+        self.output_size = list(input_size)
         self.output_size[1] = 1
         self.output_size[2] = 1
 
@@ -387,7 +386,7 @@ class paralConvBlock(object):
                                epsilon=1e-5,
                                decay=0.9)
 
-        self.output_size = copy.deepcopy(self.conv1.output_size)
+        self.output_size = list(self.conv1.output_size)
         self.output_size[-1] = self.conv1.output_size[-1] + self.conv2.output_size[-1]
 
     def add_to_graph(self):
@@ -438,7 +437,7 @@ class copyConnection(object):
         self.name = name
         self.input_size = input_size
         self.mode = mode
-        self.output_size = copy.deepcopy(input_size)
+        self.output_size = list(input_size)
 
         if mode == 'load':
             self.output_size[-1] = self.output_size[-1] * 2
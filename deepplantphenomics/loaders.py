@@ -5,6 +5,7 @@ import random
 import os
 import datetime
 import json
+import functools
 
 
 def split_raw_data(images, labels, test_ratio=0, validation_ratio=0, moderation_features=None, augmentation_images=None,
@@ -117,10 +118,17 @@ def label_string_to_tensor(x, batch_size, num_outputs=-1):
 
 
 def get_dir_images(dirname):
-    dir_files = sorted([os.path.join(dirname, f) for f in os.listdir(dirname)])
-    is_file = [os.path.isfile(f) for f in dir_files]
-    is_image = [os.path.splitext(f)[1].lower() in ['.jpg', '.jpeg', '.png'] for f in dir_files]
-    return [f for (f, b1, b2) in zip(dir_files, is_file, is_image) if b1 and b2]
+    with os.scandir(dirname) as entries:
+        return sorted([entry.path for entry in entries
+                       if entry.is_file() and os.path.splitext(entry.name)[1].lower() in ['.jpg', '.jpeg', '.png']])
+
+
+def get_dir_files(dirname, suffix='', prefix=''):
+    """Gets the paths of the files in a directory with names starting with prefix and ending with suffix, in the
+    order the directory lists them. Uses a single scandir pass so each file doesn't need to be stat-ed separately."""
+    with os.scandir(dirname) as entries:
+        return [entry.path for entry in entries
+                if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(suffix)]
 
 
 def read_csv_labels(file_name, column_number=False, character=','):
@@ -139,34 +147,35 @@ def read_csv_labels(file_name, column_number=False, character=','):
     return labels
 
 
+@functools.lru_cache(maxsize=64)
+def _read_csv_rows_cached(file_path, modified_time, file_size, inode, character):
+    """
+    Reads and splits the rows of a csv file into a tuple of tuples. Results are cached by the file's absolute path,
+    modification time, size and inode, so reloading the same labels is free and any changes to the file are still
+    picked up. The size and inode catch rewrites within one tick of a file system with coarse timestamps.
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return tuple(tuple(line.rstrip().split(character)) for line in f)
+
+
+def _read_csv_rows(file_name, character):
+    stat = os.stat(file_name)
+    return _read_csv_rows_cached(os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size, stat.st_ino, character)
+
+
 def read_csv_rows(file_name, column_number=False, character=','):
     """
     Reads the rows of a csv file and returns them as a list.
 
     read_csv_labels and its variants read column-wise, this function is needed for row-wise parsing
     """
-    f = open(file_name, 'r', encoding='utf-8-sig')
-    rows = []
-
-    for line in f:
-        line = line.rstrip()
-        curr_row = line.split(character)
-        rows.append(curr_row)
-
-    return rows
+    return [list(row) for row in _read_csv_rows(file_name, character)]
 
 
 def read_csv_labels_and_ids(file_name, column_number, id_column_number, character=','):
-    f = open(file_name, 'r', encoding='utf-8-sig')
-    labels = []
-    ids = []
-
-    for line in f:
-        line = line.rstrip()
-
-        temp = line.split(character)
-        labels.append(temp[column_number])
-        ids.append(temp[id_column_number])
+    rows = _read_csv_rows(file_name, character)
+    labels = [row[column_number] for row in rows]
+    ids = [row[id_column_number] for row in rows]
 
     return labels, ids
 
@@ -280,6 +289,25 @@ def box_coordinates_to_xywh_coordinates(coords):
     return x, y, w, h
 
 
+def box_coordinates_to_xywh_array(coords):
+    """
+    Vectorized version of box_coordinates_to_xywh_coordinates, converting a list of multiple boxes' coordinate rows at
+    once into an Nx4 integer array of their x,y,w,h
+    """
+    coords = np.asarray(coords)
+    if coords.size == 0:
+        return np.empty((0, 4), dtype=np.int64)
+
+    x1, y1, x2, y2 = coords[:, [0, 1, 4, 5]].astype(np.int64).T
+
+    w = x2 - x1
+    h = y2 - y1
+    x = (w / 2 + x1).astype(np.int64)
+    y = (h / 2 + y1).astype(np.int64)
+
+    return np.stack([x, y, w, h], axis=1)
+
+
 def csv_points_to_tuples(labels):
     """Converts nested lists of string x,y,x,y,... points to int point tuples"""
     def string_list_to_ints(str_list):
@@ -4,13 +4,13 @@ import tensorflow.compat.v1 as tf
 import os
 import json
 import warnings
-import copy
-import itertools
 import shutil
+import cv2
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 from collections.abc import Sequence
 from scipy.special import expit
-from PIL import Image
 from tqdm import tqdm
 
 
@@ -33,6 +33,8 @@ class ObjectDetectionModel(DPPModel):
         # Yolo-specific parameters, non-default values defined by set_yolo_parameters
         self._grid_w = 7
         self._grid_h = 7
+        self._grid_cell_y, self._grid_cell_x = np.divmod(np.arange(self._grid_w * self._grid_h, dtype=np.float32),
+                                                         self._grid_w)
         self._LABELS = ['plant']
         self._NUM_CLASSES = 1
         self._RAW_ANCHORS = [(159, 157), (103, 133), (91, 89), (64, 65), (142, 101)]
@@ -71,6 +73,9 @@ class ObjectDetectionModel(DPPModel):
             self._grid_w, self._grid_h = grid_size
         else:
             self._grid_w, self._grid_h = [7, 7]
+        # Column and row of each (flattened) grid cell, used when decoding box coordinates
+        self._grid_cell_y, self._grid_cell_x = np.divmod(np.arange(self._grid_w * self._grid_h, dtype=np.float32),
+                                                         self._grid_w)
 
         if labels:
             if not isinstance(labels, Sequence) or isinstance(labels, str) \
@@ -223,7 +228,7 @@ class ObjectDetectionModel(DPPModel):
             tf.summary.scalar('validation/loss', self._graph_ops['val_losses'],
                               collections=['custom_summaries'])
 
-        self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_merge_summaries()
 
     def _assemble_graph(self):
         with self._graph.as_default():
@@ -245,14 +250,14 @@ class ObjectDetectionModel(DPPModel):
 
                 # Batch the datasets and create iterators for them
                 self._train_dataset = self._train_dataset.map(_deserialize_label, num_parallel_calls=self._num_threads)
-                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True)
+                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True, images=True, augment=True)
                 if self._testing:
                     self._test_dataset = self._test_dataset.map(_deserialize_label,
                                                                 num_parallel_calls=self._num_threads)
-                    test_iter = self._batch_and_iterate(self._test_dataset)
+                    test_iter = self._batch_and_iterate(self._test_dataset, images=True)
                 if self._validation:
                     self._val_dataset = self._val_dataset.map(_deserialize_label, num_parallel_calls=self._num_threads)
-                    val_iter = self._batch_and_iterate(self._val_dataset)
+                    val_iter = self._batch_and_iterate(self._val_dataset, images=True)
 
                 if self._has_moderation:
                     train_mod_iter = self._batch_and_iterate(self._train_moderation_features)
@@ -382,22 +387,23 @@ class ObjectDetectionModel(DPPModel):
             all_y = np.concatenate(all_y, axis=0)
             all_predictions = np.concatenate(all_predictions, axis=0)
 
-            # Make the images heterogeneous, storing their separate grids in a list
-            test_labels = [all_y[i, ...] for i in range(all_y.shape[0])]
-            test_preds = [all_predictions[i, ...] for i in range(all_predictions.shape[0])]
-            n_images = len(test_labels)
+            # Convert coordinates and pick out the responsible predicted boxes for all of the images at once
+            all_y, all_predictions = self.__yolo_coord_convert(all_y, all_predictions)
+            all_predictions = self.__yolo_responsible_boxes(all_predictions)
 
-            # Convert coordinates, then filter out the positive ground truth labels and significant predictions
-            for i in range(n_images):
-                conv_label, conv_pred = self.__yolo_coord_convert(test_labels[i], test_preds[i])
+            # Make the images heterogeneous, filtering out the positive ground truth labels and significant predictions
+            # and storing their separate grids in a list
+            test_labels = []
+            test_preds = []
+            for conv_label, conv_pred in zip(all_y, all_predictions):
                 truth_mask = conv_label[..., 0] == 1
                 if not np.any(truth_mask):
                     conv_label = None
                 else:
                     conv_label = conv_label[truth_mask, :]
                 conv_pred = self.__yolo_filter_predictions(conv_pred)
-                test_labels[i] = conv_label
-                test_preds[i] = conv_pred
+                test_labels.append(conv_label)
+                test_preds.append(conv_pred)
 
             # Get and log the map
             yolo_map = self.__yolo_map(test_labels, test_preds)
@@ -409,42 +415,42 @@ class ObjectDetectionModel(DPPModel):
         Converts Yolo labeled and predicted bounding boxes from xywh coords to x1y1x2y2 coords. Also accounts for
         required sigmoid and exponential conversions in the predictions (including the confidences)
 
-        :param labels: ndarray with Yolo ground-truth bounding boxes (size ?x(NUM_CLASSES+5))
-        :param preds: ndarray with Yolo predicted bounding boxes (size ?x(NUM_BOXES*5))
+        :param labels: ndarray with Yolo ground-truth bounding boxes (size [?x]?x(NUM_CLASSES+5))
+        :param preds: ndarray with Yolo predicted bounding boxes (size [?x]?x(NUM_BOXES*5+NUM_CLASSES))
         :return: `labels` and `preds` with the bounding box coords changed from xywh to x1y1x2y2 and predicted box
         confidences converted to percents
         """
 
         def xywh_to_xyxy(x, y, w, h):
-            x_centre = np.arange(self._grid_w * self._grid_h) % self._grid_w
-            y_centre = np.arange(self._grid_w * self._grid_h) // self._grid_w
-            scale_x = self._image_width / self._grid_w
-            scale_y = self._image_height / self._grid_h
+            x_centre = self._grid_cell_x
+            y_centre = self._grid_cell_y
+            scale_x = np.float32(self._image_width / self._grid_w)
+            scale_y = np.float32(self._image_height / self._grid_h)
 
             x = (x + x_centre) * scale_x
             y = (y + y_centre) * scale_y
-            w = w * scale_x
-            h = h * scale_y
+            half_w = 0.5 * w * scale_x
+            half_h = 0.5 * h * scale_y
 
-            x1 = x - w/2
-            x2 = x + w/2
-            y1 = y - h/2
-            y2 = y + h/2
+            x1 = x - half_w
+            x2 = x + half_w
+            y1 = y - half_h
+            y2 = y + half_h
             return x1, y1, x2, y2
 
         if labels is not None:
             # Labels are already sensible numbers, so convert them first
             lab_coord_idx = np.arange(labels.shape[-1]-4, labels.shape[-1])
             lab_class, lab_x, lab_y, lab_w, lab_h = np.split(labels, lab_coord_idx, axis=-1)
-            lab_x1, lab_y1, lab_x2, lab_y2 = xywh_to_xyxy(np.squeeze(lab_x),  # Squeezing to aid broadcasting in helper
-                                                          np.squeeze(lab_y),
-                                                          np.squeeze(lab_w),
-                                                          np.squeeze(lab_h))
+            lab_x1, lab_y1, lab_x2, lab_y2 = xywh_to_xyxy(lab_x[..., 0],  # Dropping dims to aid broadcasting in helper
+                                                          lab_y[..., 0],
+                                                          lab_w[..., 0],
+                                                          lab_h[..., 0])
             labels = np.concatenate([lab_class,
-                                     lab_x1[:, np.newaxis],  # Dummy dimensions to enable concatenation
-                                     lab_y1[:, np.newaxis],
-                                     lab_x2[:, np.newaxis],
-                                     lab_y2[:, np.newaxis]], axis=-1)
+                                     lab_x1[..., np.newaxis],  # Dummy dimensions to enable concatenation
+                                     lab_y1[..., np.newaxis],
+                                     lab_x2[..., np.newaxis],
+                                     lab_y2[..., np.newaxis]], axis=-1)
 
         if preds is not None:
             # Extract the class predictions and reorganize the predicted boxes
@@ -452,20 +458,20 @@ class ObjectDetectionModel(DPPModel):
             preds = np.reshape(preds[..., 0:self._NUM_BOXES * 5], preds.shape[:-1] + (self._NUM_BOXES, 5))
 
             # Predictions are not sensible numbers, so apply sigmoids and exponentials first and then convert them
-            anchors = np.array(self._ANCHORS)
+            anchors = np.array(self._ANCHORS, dtype=np.float32)
             pred_x = expit(preds[..., 0])
             pred_y = expit(preds[..., 1])
             pred_w = np.exp(preds[..., 2]) * anchors[:, 0]
             pred_h = np.exp(preds[..., 3]) * anchors[:, 1]
             pred_conf = expit(preds[..., 4])
-            pred_x1, pred_y1, pred_x2, pred_y2 = xywh_to_xyxy(pred_x.T,  # Transposes to aid broadcasting in helper
-                                                              pred_y.T,
-                                                              pred_w.T,
-                                                              pred_h.T)
-            preds[..., :] = np.stack([pred_x1.T,  # Transposes to restore original shape
-                                      pred_y1.T,
-                                      pred_x2.T,
-                                      pred_y2.T,
+            pred_x1, pred_y1, pred_x2, pred_y2 = xywh_to_xyxy(np.moveaxis(pred_x, -1, 0),  # Boxes first to aid
+                                                              np.moveaxis(pred_y, -1, 0),  # broadcasting in helper
+                                                              np.moveaxis(pred_w, -1, 0),
+                                                              np.moveaxis(pred_h, -1, 0))
+            preds[..., :] = np.stack([np.moveaxis(pred_x1, 0, -1),  # Restoring the original shape
+                                      np.moveaxis(pred_y1, 0, -1),
+                                      np.moveaxis(pred_x2, 0, -1),
+                                      np.moveaxis(pred_y2, 0, -1),
                                       pred_conf], axis=-1)
 
             # Reattach the class predictions
@@ -474,23 +480,65 @@ class ObjectDetectionModel(DPPModel):
 
         return labels, preds
 
-    def __yolo_filter_predictions(self, preds):
+    def __yolo_graph_coord_convert(self, preds):
         """
-        Filters the predicted bounding boxes by eliminating insignificant and overlapping predictions
+        Graph equivalent of the prediction conversions in __yolo_coord_convert: applies the required sigmoid and
+        exponential conversions and changes the predicted boxes from xywh to x1y1x2y2 coords
 
-        :param preds: ndarray with predicted bounding boxes for one image in each grid square. Predictions
-        are a list of, for each box, [x1, y1, x2, y2, conf] followed by a list of class predictions
-        :return: `preds` with only the significant and maximal confidence predictions remaining
+        :param preds: Tensor with Yolo predictions (size ?x(grid_w*grid_h)x(NUM_BOXES*5+NUM_CLASSES))
+        :return: `preds` with the bounding box coords changed from xywh to x1y1x2y2 and predicted box confidences
+        converted to percents
+        """
+        class_preds = preds[..., self._NUM_BOXES * 5:]
+        boxes = tf.reshape(preds[..., 0:self._NUM_BOXES * 5], [-1, self._grid_w * self._grid_h, self._NUM_BOXES, 5])
+
+        # Grid offsets get a dummy box dimension so they broadcast over each grid square's boxes
+        anchors = tf.constant(self._ANCHORS, dtype=tf.float32)
+        x_centre = tf.constant(self._grid_cell_x[:, np.newaxis])
+        y_centre = tf.constant(self._grid_cell_y[:, np.newaxis])
+        scale_x = self._image_width / self._grid_w
+        scale_y = self._image_height / self._grid_h
+
+        x = (tf.sigmoid(boxes[..., 0]) + x_centre) * scale_x
+        y = (tf.sigmoid(boxes[..., 1]) + y_centre) * scale_y
+        half_w = 0.5 * tf.exp(boxes[..., 2]) * anchors[:, 0] * scale_x
+        half_h = 0.5 * tf.exp(boxes[..., 3]) * anchors[:, 1] * scale_y
+        conf = tf.sigmoid(boxes[..., 4])
+
+        boxes = tf.stack([x - half_w, y - half_h, x + half_w, y + half_h, conf], axis=-1)
+        boxes = tf.reshape(boxes, [-1, self._grid_w * self._grid_h, self._NUM_BOXES * 5])
+
+        return tf.concat([boxes, class_preds], axis=-1)
+
+    def __yolo_responsible_boxes(self, preds):
+        """
+        Picks out the box responsible for prediction (i.e. the highest confidence box) in each grid square. This works
+        over any number of leading dimensions, so whole batches of images or patches can be handled at once.
+
+        :param preds: ndarray with predicted bounding boxes in each grid square (size ...x(NUM_BOXES*5+NUM_CLASSES)).
+        Predictions are a list of, for each box, [x1, y1, x2, y2, conf] followed by a list of class predictions
+        :return: ndarray with the responsible box and class predictions in each grid square (size ...x(5+NUM_CLASSES))
         """
         # Extract the class predictions and separate the predicted boxes
-        grid_count = preds.shape[0]
         class_preds = preds[..., self._NUM_BOXES * 5:]
         preds = np.reshape(preds[..., 0:self._NUM_BOXES * 5], preds.shape[:-1] + (self._NUM_BOXES, 5))
 
         # In each grid square, the highest confidence box is the one responsible for prediction
         max_conf_idx = np.argmax(preds[..., 4], axis=-1)
-        responsible_boxes = [preds[i, max_conf_idx[i], :] for i in range(grid_count)]
-        preds = np.stack(responsible_boxes, axis=0)
+        preds = np.take_along_axis(preds, max_conf_idx[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+
+        return np.concatenate([preds, class_preds], axis=-1)
+
+    def __yolo_filter_predictions(self, preds):
+        """
+        Filters the predicted bounding boxes by eliminating insignificant and overlapping predictions
+
+        :param preds: ndarray with the responsible predicted bounding box for one image in each grid square (see
+        __yolo_responsible_boxes). Predictions are [x1, y1, x2, y2, conf] followed by a list of class predictions
+        :return: `preds` with only the significant and maximal confidence predictions remaining
+        """
+        class_preds = preds[:, 5:]
+        preds = preds[:, 0:5]
 
         # Eliminate insignificant predicted boxes
         sig_mask = preds[:, 4] > self._THRESH_SIG
@@ -500,32 +548,45 @@ class ObjectDetectionModel(DPPModel):
         preds = preds[sig_mask, :]
 
         # Apply non-maximal suppression (i.e. eliminate boxes that overlap with a more confidant box)
+        maximal_idx = self.__yolo_non_max_suppression(preds)
+
+        # Stick things back together. maximal_idx is not sorted, but box and class predictions should still match up
+        # and the original grid order shouldn't matter for mAP calculations
+        class_preds = class_preds[maximal_idx, :]
+        preds = preds[maximal_idx, :]
+        preds = np.concatenate([preds, class_preds], axis=-1)
+
+        return preds
+
+    def __yolo_non_max_suppression(self, boxes):
+        """
+        Performs non-maximal suppression on a set of predicted bounding boxes, eliminating boxes that overlap with a
+        more confidant box
+
+        :param boxes: ndarray with predicted bounding boxes (size ?x5), each being [x1, y1, x2, y2, conf]
+        :return: A list of the indices of the maximal boxes in `boxes`
+        """
         maximal_idx = []
-        sig_grid_count = preds.shape[0]
-        conf_order = np.argsort(preds[:, 4])
-        pair_iou = np.array([self.__compute_iou(preds[i, 0:4], preds[j, 0:4])
-                             for i in range(sig_grid_count) for j in range(sig_grid_count)])
-        pair_iou = pair_iou.reshape(sig_grid_count, sig_grid_count)
+        box_count = boxes.shape[0]
+        conf_order = np.argsort(boxes[:, 4])
+        box_coords = boxes[:, 0:4].tolist()
+        pair_iou = np.array([self.__compute_iou(box_coords[i], box_coords[j])
+                             for i in range(box_count) for j in range(box_count)])
+        pair_iou = pair_iou.reshape(box_count, box_count)
         while len(conf_order) > 0:
             # Take the most confidant box, then cull the list down to boxes that don't overlap with it
-            cur_grid = conf_order[-1]
-            maximal_idx.append(cur_grid)
-            non_overlap = pair_iou[cur_grid, conf_order] < self._THRESH_OVERLAP
+            cur_box = conf_order[-1]
+            maximal_idx.append(cur_box)
+            non_overlap = pair_iou[cur_box, conf_order] < self._THRESH_OVERLAP
             if np.any(non_overlap):
                 conf_order = conf_order[non_overlap]
                 # Make sure that the most confidant box itself isn't still in the list (usually by having a self-IOU of
                 # 0.999999... when the overlap threshold is 1)
-                conf_order = conf_order[conf_order != cur_grid]
+                conf_order = conf_order[conf_order != cur_box]
             else:
                 break
 
-        # Stick things back together. maximal_idx is not sorted, but box and class predictions should still match up
-        # and the original grid order shouldn't matter for mAP calculations
-        class_preds = class_preds[maximal_idx, :]
-        preds = preds[maximal_idx, :]
-        preds = np.concatenate([preds, class_preds], axis=-1)
-
-        return preds
+        return maximal_idx
 
     def __yolo_map(self, labels, preds):
         """
@@ -557,7 +618,9 @@ class ObjectDetectionModel(DPPModel):
 
             # Calculate the IoUs of all the prediction and label pairings, then record each detection as a true or
             # false positive with the prediction confidence
-            pair_ious = np.array([self.__compute_iou(im_pred[i, 0:4], im_lab[j, 2:6])
+            pred_coords = im_pred[:, 0:4].tolist()
+            lab_coords = im_lab[:, 2:6].tolist()
+            pair_ious = np.array([self.__compute_iou(pred_coords[i], lab_coords[j])
                                   for i in range(n_pred) for j in range(n_lab)])
             pair_ious = np.reshape(pair_ious, (n_pred, n_lab))
             for i in range(n_pred):
@@ -594,6 +657,17 @@ class ObjectDetectionModel(DPPModel):
         return ap
 
     def forward_pass_with_file_inputs(self, images):
+        return self.__run_forward_pass_with_file_inputs(images)
+
+    def __run_forward_pass_with_file_inputs(self, images, convert_coords=False):
+        """
+        Runs the network over a list of image files, optionally converting the predicted boxes to x1y1x2y2 coords within
+        the graph so that the conversion happens on the same device as the network
+
+        :param images: List of strings representing image filenames
+        :param convert_coords: Whether to apply the box conversions of __yolo_graph_coord_convert to the outputs
+        :return: ndarray with the network outputs for each image (and patch, if patching is used)
+        """
         with self._graph.as_default():
             num_batches = len(images) // self._batch_size
             if len(images) % self._batch_size != 0:
@@ -628,6 +702,9 @@ class ObjectDetectionModel(DPPModel):
 
             # Run model on them
             x_pred = self.forward_pass(x_test, deterministic=True)
+            if convert_coords:
+                x_pred = tf.reshape(x_pred, [-1, self._grid_w * self._grid_h, 5 * self._NUM_BOXES + self._NUM_CLASSES])
+                x_pred = self.__yolo_graph_coord_convert(x_pred)
 
             if self._with_patching:
                 xx_output_size = [-1, num_patch_rows * num_patch_cols,
@@ -649,7 +726,10 @@ class ObjectDetectionModel(DPPModel):
         return total_outputs
 
     def forward_pass_with_interpreted_outputs(self, x):
-        total_outputs = self.forward_pass_with_file_inputs(x)
+        # The box coordinates are converted in the graph, and the responsible boxes can be found for every image and
+        # patch at once. Only the filtering and suppression of boxes needs to be done per image.
+        total_outputs = np.asarray(self.__run_forward_pass_with_file_inputs(x, convert_coords=True), dtype=np.float32)
+        total_outputs = self.__yolo_responsible_boxes(total_outputs)
         n_images = total_outputs.shape[0]
 
         if self._with_patching:
@@ -661,15 +741,13 @@ class ObjectDetectionModel(DPPModel):
             for i in range(n_images):
                 patch_preds = []
                 for j in range(num_patches):
-                    _, conv_preds = self.__yolo_coord_convert(None, total_outputs[i, j, ...])
-                    filtered_preds = self.__yolo_filter_predictions(conv_preds)
+                    filtered_preds = self.__yolo_filter_predictions(total_outputs[i, j, ...])
                     patch_preds.append(filtered_preds)
                 im_preds.append(patch_preds)
         else:
             im_preds = []
             for i in range(n_images):
-                _, conv_preds = self.__yolo_coord_convert(None, total_outputs[i, ...])
-                filtered_preds = self.__yolo_filter_predictions(conv_preds)
+                filtered_preds = self.__yolo_filter_predictions(total_outputs[i, ...])
                 im_preds.append(filtered_preds)
 
         return im_preds
@@ -682,17 +760,21 @@ class ObjectDetectionModel(DPPModel):
         :param box2: x1, y1, x2, y2
         :return: Intersection Over Union of box1 and box2
         """
-        x1 = np.maximum(box1[0], box2[0])
-        y1 = np.maximum(box1[1], box2[1])
-        x2 = np.minimum(box1[2], box2[2])
-        y2 = np.minimum(box1[3], box2[3])
+        # Boxes are small enough that plain Python floats beat the dispatch overhead of NumPy's element-wise functions
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
 
-        intersection_area = np.maximum(0., x2 - x1) * np.maximum(0., y2 - y1)
+        intersection_area = max(0., x2 - x1) * max(0., y2 - y1)
         union_area = \
             ((box1[2] - box1[0]) * (box1[3] - box1[1])) + \
             ((box2[2] - box2[0]) * (box2[3] - box2[1])) - \
             intersection_area
 
+        # Degenerate zero-size boxes have no area to overlap with
+        if union_area <= 0:
+            return 0.0
         return intersection_area / union_area
 
     def add_output_layer(self, regularization_coefficient=None, output_size=None):
@@ -708,12 +790,12 @@ class ObjectDetectionModel(DPPModel):
         self._log('Adding output layer...')
 
         filter_dimension = [1, 1,
-                            copy.deepcopy(self._last_layer().output_size[3]),
+                            self._last_layer().output_size[3],
                             (5 * self._NUM_BOXES + self._NUM_CLASSES)]
 
         with self._graph.as_default():
             layer = layers.convLayer('output',
-                                     copy.deepcopy(self._last_layer().output_size),
+                                     self._last_layer_output_size(),
                                      filter_dimension,
                                      1,
                                      None,
@@ -729,60 +811,30 @@ class ObjectDetectionModel(DPPModel):
         """
         self._resize_bbox_coords = True
 
-        images = [os.path.join(dirname, name) for name in sorted(os.listdir(dirname)) if
-                  os.path.isfile(os.path.join(dirname, name)) & name.endswith('_rgb.png')]
-
-        label_files = [os.path.join(dirname, name) for name in sorted(os.listdir(dirname)) if
-                       os.path.isfile(os.path.join(dirname, name)) & name.endswith('_bbox.csv')]
+        images = sorted(loaders.get_dir_files(dirname, suffix='_rgb.png'))
 
-        # currently reads columns, need to read rows instead!!!
-        labels = [loaders.read_csv_rows(label_file) for label_file in label_files]
+        label_files = sorted(loaders.get_dir_files(dirname, suffix='_bbox.csv'))
 
-        self._all_labels = []
-        for label in labels:
-            curr_label = []
-            for nums in label:
-                # yolo wants x,y,w,h for coords
-                curr_label.extend(loaders.box_coordinates_to_xywh_coordinates(nums))
-            self._all_labels.append(curr_label)
+        # Each bbox file is parsed into an array of box rows, going through the cached csv reader (which also handles
+        # files starting with a UTF-8 BOM). The files are independent, so they're read in parallel.
+        def read_bbox_file(label_file):
+            rows = [row for row in loaders.read_csv_rows(label_file) if row != ['']]
+            if not rows:
+                return np.empty((0, 8))  # An empty file has no boxes
+            return np.array(rows, dtype=np.float64)
 
-        self._total_raw_samples = len(images)
+        with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+            labels = list(executor.map(read_bbox_file, label_files))
 
-        # need to add object-ness flag and one-hot encodings for class
-        # it will be 1 or 0 for object-ness, one-hot for the class, then 4 bbox coords (x,y,w,h)
-        # e.g. [1,0,0,...,1,...,0,223,364,58,62] but since there is only one class for the ippn dataset we get
-        # [1,1,x,y,w,h]
+        # yolo wants x,y,w,h for coords. Every image's boxes are converted at once, keeping track of where each image's
+        # boxes start and end.
+        box_offsets = np.cumsum([0] + [label.shape[0] for label in labels])
+        img_box_ranges = list(zip(box_offsets[:-1], box_offsets[1:]))
+        all_coords = loaders.box_coordinates_to_xywh_array(
+            np.concatenate([label for label in labels if label.size] or [np.empty((0, 8))]))
+        self._all_labels = [all_coords[start:end].reshape(-1).tolist() for start, end in img_box_ranges]
 
-        # for scaling bbox coords
-        # scaling image down to the grid size
-        scale_ratio_w = self._grid_w / self._image_width_original
-        scale_ratio_h = self._grid_h / self._image_height_original
-
-        labels_with_one_hot = []
-        for curr_img_coords in self._all_labels:
-            curr_img_labels = []
-            num_boxes = len(curr_img_coords) // 4
-            for i in range(num_boxes):
-                # start the current box label with the object-ness flag and class label (there is only one class
-                # for ippn)
-                curr_box = [1, 1]
-                # add scaled bbox coords
-                j = i * 4
-                # x and y offsets from grid position
-                x_grid = curr_img_coords[j] * scale_ratio_w
-                y_grid = curr_img_coords[j + 1] * scale_ratio_h
-                x_grid_offset, x_grid_loc = np.modf(x_grid)
-                y_grid_offset, y_grid_loc = np.modf(y_grid)
-                # w and h ratios from anchor box
-                w_ratio = curr_img_coords[j + 2] / self._ANCHORS[0]
-                h_ratio = curr_img_coords[j + 3] / self._ANCHORS[1]
-                curr_box.append(x_grid_offset)
-                curr_box.append(y_grid_offset)
-                curr_box.append(w_ratio)
-                curr_box.append(h_ratio)
-                curr_img_labels.extend(curr_box)
-            labels_with_one_hot.append(curr_img_labels)
-        self._raw_labels = labels_with_one_hot
+        self._total_raw_samples = len(images)
 
         self._log('Total raw examples is %d' % self._total_raw_samples)
         self._log('Parsing dataset...')
@@ -847,22 +899,62 @@ class ObjectDetectionModel(DPPModel):
         os.makedirs(patch_dir)
         os.makedirs(img_dir)
 
-        # We need to construct a patched dataset, but we'll be picking them out with various methods
-        img_dict = {}
+        # We need to construct a patched dataset, but we'll be picking them out with various methods. The patch labels
+        # are streamed out to the JSON file as each patch is recorded rather than being kept until the end.
+        # One compact encoder is reused for every entry, which skips the circular reference checks and the whitespace.
+        json_fh = open(json_file, 'w', encoding='utf-8', buffering=1 << 20)
+        json_encoder = json.JSONEncoder(check_circular=False, separators=(',', ':'))
+        json_fh.write('{')
         new_raw_image_files = []
         new_raw_labels = []
 
-        def add_patch_to_dataset(patch, file_boxes, raw_boxes, patch_idx):
+        # The patch and grid sizes are used throughout the patching loops, so they're kept as locals
+        patch_width, patch_height = self._patch_width, self._patch_height
+        grid_w, grid_h = self._grid_w, self._grid_h
+        half_width, half_height = patch_width // 2, patch_height // 2
+
+        # Patches that are slices of the source image are views that OpenCV would otherwise copy internally, so they get
+        # copied into a reused contiguous buffer for saving instead of having a new array allocated for each of them.
+        # It only needs to be reallocated when the patch shape changes and there's one per thread, since images may be
+        # patched in parallel. Patches that are already contiguous 8-bit arrays (e.g. the augmented patches made by
+        # OpenCV) are written out directly.
+        patch_bufs = threading.local()
+
+        def save_patch(patch, patch_idx):
+            patch_buf = patch
+            if patch.dtype != np.uint8 or not patch.flags.c_contiguous:
+                patch_buf = getattr(patch_bufs, 'buf', None)
+                if patch_buf is None or patch_buf.shape != patch.shape:
+                    patch_buf = patch_bufs.buf = np.empty(patch.shape, dtype=np.uint8)
+                np.copyto(patch_buf, patch, casting='unsafe')
+
+            # Patches are throwaway training data, so a low PNG compression level is worth the much faster encoding.
+            # Images are both read and written by OpenCV, so the BGR channel order round-trips to the right colours.
             patch_name = os.path.join(img_dir + "{:0>6d}.png".format(patch_idx))
-            patch_img = Image.fromarray(patch.astype(np.uint8))
-            patch_img.save(patch_name)
-
-            img_dict["{:0>6d}".format(patch_idx)] = {"height": self._patch_height,
-                                                     "width": self._patch_width,
-                                                     "file_name": "{:0>6d}.png".format(patch_idx),
-                                                     "plants": file_boxes}
-            new_raw_image_files.append(patch_name)
-            new_raw_labels.append(raw_boxes)
+            if not cv2.imwrite(patch_name, patch_buf, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+                raise RuntimeError("Could not write image patch to " + patch_name)
+            return patch_name
+
+        def record_patches(img_patches):
+            # Records all of one image's (patch_name, raw_boxes, patch_idx) patches at once. Patches only carry their
+            # raw [x_min, x_max, y_min, y_max] boxes around, and the per-plant point dicts for the JSON file are only
+            # made here as they're written out.
+            if not img_patches:
+                return
+            json_entries = []
+            for _, raw_boxes, patch_idx in img_patches:
+                patch_id = "{:0>6d}".format(patch_idx)
+                json_entries.append('"' + patch_id + '":' + json_encoder.encode(
+                    {"height": patch_height,
+                     "width": patch_width,
+                     "file_name": patch_id + ".png",
+                     "plants": [{"all_points_x": box[0:2], "all_points_y": box[2:4]} for box in raw_boxes]}))
+            if new_raw_image_files:
+                json_fh.write(',')
+            json_fh.write(','.join(json_entries))
+
+            new_raw_image_files.extend([patch_name for patch_name, _, _ in img_patches])
+            new_raw_labels.extend([raw_boxes for _, raw_boxes, _ in img_patches])
 
         def xywh_to_tblr_coords(cx, cy, width, height):
             top = cy - height // 2
@@ -885,202 +977,218 @@ class ObjectDetectionModel(DPPModel):
             cy_shift = p_height // 2 + dy
             return cx_shift, cy_shift
 
-        def get_random_patch(orig_img, p_width, p_height):
-            px_centre, py_centre = p_width // 2, p_height // 2
-            min_width, max_width = px_centre, orig_img.shape[1] - px_centre
-            min_height, max_height = py_centre, orig_img.shape[0] - py_centre
+        def get_random_centres(orig_img, num_patches, rng):
+            min_width, max_width = half_width, orig_img.shape[1] - half_width
+            min_height, max_height = half_height, orig_img.shape[0] - half_height
+
+            rand_xs = rng.integers(min_width, max_width, size=num_patches, endpoint=True)
+            rand_ys = rng.integers(min_height, max_height, size=num_patches, endpoint=True)
+            return rand_xs, rand_ys
 
-            rand_x = np.random.randint(min_width, max_width + 1)
-            rand_y = np.random.randint(min_height, max_height + 1)
-            top, bot, left, right = xywh_to_tblr_coords(rand_x, rand_y, p_width, p_height)
-            patch = orig_img[top:bot, left:right]
+        def get_patches_at_centres(orig_img, box_xywh, centre_xs, centre_ys):
+            # Patches are yielded one by one as views of the image, along with an array of the boxes in them
+            tops, bots, lefts, rights = xywh_to_tblr_coords(centre_xs, centre_ys, patch_width, patch_height)
+            for top, bot, left, right in zip(tops.tolist(), bots.tolist(), lefts.tolist(), rights.tolist()):
+                yield orig_img[top:bot, left:right], get_boxes_in_patch([top, bot, left, right], box_xywh)
 
-            return patch, [top, bot, left, right]
+        def get_box_xywh(boxes):
+            # Converts a list of [x_min, x_max, y_min, y_max] boxes into a 4xN array of their x, y, w, and h values so
+            # that all of an image's boxes can be checked and shifted at once
+            boxes = np.reshape(np.asarray(boxes), (-1, 4))
+            return np.stack(xyxy_to_xywh_coords(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]))
 
-        def get_boxes_in_patch(p_tblr, boxes):
+        def get_boxes_in_patch(p_tblr, box_xywh):
             p_top, p_bot, p_left, p_right = p_tblr
             p_width, p_height = (p_right - p_left), (p_bot - p_top)
-            patch_boxes = []
-            for orig_box in boxes:
-                orig_x, orig_y, orig_w, orig_h = xyxy_to_xywh_coords(*orig_box)
-                if p_left <= orig_x <= p_right and p_top <= orig_y <= p_bot:
-                    cx, cy = p_left + p_width // 2, p_top + p_height // 2
-                    patch_x, patch_y = image_to_patch_xy(orig_x, orig_y, cx, cy, p_width, p_height)
-                    patch_y_min, patch_y_max, patch_x_min, patch_x_max = xywh_to_tblr_coords(patch_x, patch_y,
-                                                                                             orig_w, orig_h)
-                    patch_boxes.append([patch_x_min, patch_x_max, patch_y_min, patch_y_max])
-
-            return patch_boxes
+            orig_x, orig_y, _, _ = box_xywh
+            in_patch = (p_left <= orig_x) & (orig_x <= p_right) & (p_top <= orig_y) & (orig_y <= p_bot)
+
+            orig_x, orig_y, orig_w, orig_h = box_xywh[:, in_patch]
+            cx, cy = p_left + p_width // 2, p_top + p_height // 2
+            patch_x, patch_y = image_to_patch_xy(orig_x, orig_y, cx, cy, p_width, p_height)
+            patch_y_min, patch_y_max, patch_x_min, patch_x_max = xywh_to_tblr_coords(patch_x, patch_y, orig_w, orig_h)
+
+            return np.stack([patch_x_min, patch_x_max, patch_y_min, patch_y_max], axis=1)
 
         num_orig_images = len(self._raw_image_files)
-        img_name_idx = 0
+        grid_count = grid_h * grid_w
+        all_box_xywh = [get_box_xywh(img_boxes) for img_boxes in self._all_labels]
+
+        def patch_all_images(image_patches):
+            # Reading, slicing, and writing out the images is independent between images, so each set of patches is
+            # made for all of the images in parallel. Each image gets its own seed for its random state, and its patches
+            # are still recorded in image order.
+            seeds = np.random.randint(0, 2 ** 31 - 1, size=num_orig_images)
+            with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+                all_img_patches = executor.map(image_patches, range(num_orig_images), self._raw_image_files,
+                                               all_box_xywh, seeds)
+                for img_num, img_patches in enumerate(all_img_patches):
+                    record_patches(img_patches)
+                    self._log(str(img_num + 1) + '/' + str(num_orig_images))
 
         # First set of patches: attempt to get patches such that every YOLO grid cell will see a plant at some point
         # and learn to recognize them during training. The patches should be a small distance from the edges of the
         # image, so plants in the patches should be about 1 patch-length away from the edges to allow shifting them
         # into the appropriate grid cell.
-        for img_num, img_name, img_boxes in zip(range(num_orig_images), self._raw_image_files, self._all_labels):
-            img = np.array(Image.open(img_name))
-
-            for i, j in itertools.product(range(self._grid_h), range(self._grid_w)):
-                found_one = False
-                random_indices = list(range(len(img_boxes)))
-                while random_indices and not found_one:
-                    rand_idx = np.random.randint(0, len(random_indices))
-                    rand_plant_idx = random_indices.pop(rand_idx)
-                    box_x, box_y, box_w, box_h = xyxy_to_xywh_coords(*img_boxes[rand_plant_idx])
-                    if (self._patch_width + 5) < box_x < (img.shape[1] - (self._patch_width + 5)) \
-                            and (self._patch_height + 5) < box_y < (img.shape[0] - (self._patch_height + 5)):
-                        # This plant box meets our criteria, so get the center of the patch that places it in grid cell
-                        # (i, j)
-                        delta_x = j - self._grid_w // 2
-                        delta_y = i - self._grid_h // 2
-                        new_x = int(box_x - (delta_x * (self._patch_width / self._grid_w)))
-                        new_y = int(box_y - (delta_y * (self._patch_height / self._grid_h)))
-                        top_row, bot_row, left_col, right_col = xywh_to_tblr_coords(
-                            new_x, new_y, self._patch_width, self._patch_height)
-                        img_patch = img[top_row:bot_row, left_col:right_col]
-
-                        new_raw_boxes = get_boxes_in_patch([top_row, bot_row, left_col, right_col], img_boxes)
-                        new_boxes = []
-                        for box in new_raw_boxes:
-                            new_boxes.append({"all_points_x": box[0:2], "all_points_y": box[2:4]})
-
-                        # Save patch to disk and store labels
-                        add_patch_to_dataset(img_patch, new_raw_boxes, new_boxes, img_name_idx)
-                        img_name_idx += 1
-                        found_one = True
-                if not found_one:
-                    # If this happens, then none of the plants can meet our criteria and no patches like this can be
-                    # made for this image
-                    break
-
-            self._log(str(img_num + 1) + '/' + str(len(self._all_labels)))
-        self._log('Completed baseline patches. Total images so far: ' + str(img_name_idx))
+        mid_col, mid_row = grid_w // 2, grid_h // 2
+        cell_width, cell_height = patch_width / grid_w, patch_height / grid_h
+
+        def baseline_patches(img_num, img_name, box_xywh, seed):
+            # Each image gets its own random state and range of patch indices so that images can be patched in any order
+            rng = np.random.default_rng(seed)
+            patch_idx = img_num * grid_count
+            patches = []
+            img = cv2.imread(img_name, cv2.IMREAD_UNCHANGED)
+
+            # Only plants far enough from the image edges can be placed in any grid cell of a patch, so those are found
+            # once up front and then picked from directly
+            box_x, box_y = box_xywh[0], box_xywh[1]
+            valid_idx = np.flatnonzero((box_x > patch_width + 5) &
+                                       (box_x < img.shape[1] - (patch_width + 5)) &
+                                       (box_y > patch_height + 5) &
+                                       (box_y < img.shape[0] - (patch_height + 5)))
+            if valid_idx.size == 0:
+                # None of the plants meet our criteria, so no patches like this can be made for this image
+                return patches
+
+            # Get the centers of the patches that place a random plant box in each grid cell (i, j), in row-major order
+            rand_plant_idxs = rng.choice(valid_idx, size=grid_count)
+            delta_y, delta_x = np.divmod(np.arange(grid_count), grid_w)
+            new_xs = (box_xywh[0, rand_plant_idxs] - ((delta_x - mid_col) * cell_width)).astype(np.int64)
+            new_ys = (box_xywh[1, rand_plant_idxs] - ((delta_y - mid_row) * cell_height)).astype(np.int64)
+
+            for img_patch, patch_boxes in get_patches_at_centres(img, box_xywh, new_xs, new_ys):
+                # Save patch to disk and keep the labels for later
+                patches.append((save_patch(img_patch, patch_idx), patch_boxes.tolist(), patch_idx))
+                patch_idx += 1
+
+            return patches
+
+        patch_all_images(baseline_patches)
+        img_name_idx = num_orig_images * grid_count
+        self._log('Completed baseline patches. Total images so far: ' + str(len(new_raw_image_files)))
 
         # Second set of patches: pick patches at random with some plants in them and randomly augment them with
         # rotations, flips, and brightness adjustments
-        self._log('Creating augmentation patches...')
-        for i in range(self._grid_h * self._grid_w):
-            for img_name, img_boxes in zip(self._raw_image_files, self._all_labels):
-                img = np.array(Image.open(img_name))
-
-                # Randomly grab a patch of the image and make sure it has at least one plant in it
-                img_patch = None
-                new_boxes = []
-                while not new_boxes:
-                    img_patch, img_tblr = get_random_patch(img, self._patch_width, self._patch_height)
-                    new_boxes = get_boxes_in_patch(img_tblr, img_boxes)
-
-                # Randomly choose one of three augmentations to apply
-                aug = np.random.randint(1, 4)  # 1 == rotation, 2 == brightness, 3 == flip
+        # np.rot90 only gives a strided view, which then has to be copied out element by element for saving, while
+        # OpenCV rotates straight into a contiguous array with its optimized transpose. These are the rotations
+        # matching np.rot90(patch, k) for k = 1, 2, 3.
+        rot90_codes = {1: cv2.ROTATE_90_COUNTERCLOCKWISE, 2: cv2.ROTATE_180, 3: cv2.ROTATE_90_CLOCKWISE}
+
+        def augmentation_patches(img_num, img_name, box_xywh, seed):
+            # As with the baseline patches, each image gets its own random state and range of patch indices
+            rng = np.random.default_rng(seed)
+            patch_idx = aug_idx_start + img_num * grid_count
+            patches = []
+
+            # Each image is only decoded once for all of its augmentation patches
+            img = cv2.imread(img_name, cv2.IMREAD_UNCHANGED)
+
+            # Rather than picking patches at random until one has a plant in it, work out the range of patch centres
+            # that would include each plant (while keeping the patch inside the image) and pick from those directly
+            box_x, box_y = box_xywh[0], box_xywh[1]
+            min_cx = np.maximum(box_x - (patch_width - half_width), half_width)
+            max_cx = np.minimum(box_x + half_width, img.shape[1] - half_width)
+            min_cy = np.maximum(box_y - (patch_height - half_height), half_height)
+            max_cy = np.minimum(box_y + half_height, img.shape[0] - half_height)
+            reachable_idx = np.flatnonzero((min_cx <= max_cx) & (min_cy <= max_cy))
+            if reachable_idx.size == 0:
+                # No patch inside the image can contain a plant, so no patches like this can be made for this image
+                return patches
+
+            # All of the random choices for the image's patches are drawn up front. Each patch is centred around a
+            # random plant so it has at least one plant in it, and then gets one of three augmentations (1 == rotation,
+            # 2 == brightness, 3 == flip) applied to it.
+            plant_idxs = rng.choice(reachable_idx, size=grid_count)
+            rand_xs = rng.integers(min_cx[plant_idxs], max_cx[plant_idxs], endpoint=True)
+            rand_ys = rng.integers(min_cy[plant_idxs], max_cy[plant_idxs], endpoint=True)
+            augs = rng.integers(1, 4, size=grid_count)
+            rot_ks = rng.integers(1, 4, size=grid_count)
+            bright_values = rng.integers(40, 76, size=grid_count)  # just a 'nice amount' of brightness change
+            coin_flips = rng.random(size=grid_count)
+
+            for (img_patch, patch_boxes), aug, k, value, coin_flip in zip(
+                    get_patches_at_centres(img, box_xywh, rand_xs, rand_ys), augs.tolist(), rot_ks.tolist(),
+                    bright_values.tolist(), coin_flips.tolist()):
+                x_min, x_max, y_min, y_max = patch_boxes.T
+
+                # The boxes are moved along with the patch all at once as columns of [x_min, x_max, y_min, y_max]
                 if aug == 1:  # rotation
-                    k = np.random.randint(1, 4)
-                    rot_img_patch = np.rot90(img_patch, k)
-                    theta = np.radians(90 * k)
-                    x0 = self._patch_width // 2
-                    y0 = self._patch_height // 2
-                    rot_boxes = []
-                    raw_rot_boxes = []
-                    for box in new_boxes:
-                        rot_x_min = x0 + (box[0] - x0) * np.cos(theta) + (box[2] - y0) * np.sin(theta)
-                        rot_y_min = y0 - (box[0] - x0) * np.sin(theta) + (box[2] - y0) * np.cos(theta)
-                        w = box[1] - box[0]
-                        h = box[3] - box[2]
-                        if k == 1:  # w and h flip, x_min y_min become x_min y_max
-                            w, h = h, w
-                            rot_y_min -= h
-                        elif k == 2:  # w and h stay same, x_min y_min become x_max y_max
-                            rot_x_min -= w
-                            rot_y_min -= h
-                        else:  # w and h flip, x_min y_min become x_max y_min
-                            w, h = h, w
-                            rot_x_min -= w
-                        rot_x_max = rot_x_min + w
-                        rot_y_max = rot_y_min + h
-
-                        rot_boxes.append({"all_points_x": [rot_x_min, rot_x_max],
-                                          "all_points_y": [rot_y_min, rot_y_max]})
-                        raw_rot_boxes.append([rot_x_min, rot_x_max, rot_y_min, rot_y_max])
-
-                    # Save patch to disk and store labels
-                    add_patch_to_dataset(rot_img_patch, rot_boxes, raw_rot_boxes, img_name_idx)
-                    img_name_idx += 1
+                    aug_img_patch = cv2.rotate(img_patch, rot90_codes[k])
+                    # Rotating by multiples of 90 degrees about the patch centre only swaps and negates the box offsets
+                    # from it, so there's no need for any trig
+                    w = x_max - x_min
+                    h = y_max - y_min
+                    if k == 1:  # w and h flip, x_min y_min become x_min y_max
+                        w, h = h, w
+                        rot_x_min = half_width + (y_min - half_height)
+                        rot_y_min = half_height - (x_min - half_width) - h
+                    elif k == 2:  # w and h stay same, x_min y_min become x_max y_max
+                        rot_x_min = half_width - (x_min - half_width) - w
+                        rot_y_min = half_height - (y_min - half_height) - h
+                    else:  # w and h flip, x_min y_min become x_max y_min
+                        w, h = h, w
+                        rot_x_min = half_width - (y_min - half_height) - w
+                        rot_y_min = half_height + (x_min - half_width)
+                    aug_boxes = np.stack([rot_x_min, rot_x_min + w, rot_y_min, rot_y_min + h], axis=1)
                 elif aug == 2:  # brightness
-                    value = np.random.randint(40, 76)  # just a 'nice amount' of brightness change
-                    k = np.random.random()
-                    if k < 0.5:  # brighter
-                        bright_img_patch = np.where((255 - img_patch) < value, 255, img_patch + value)
+                    # OpenCV's saturating arithmetic clips to [0, 255] in a single pass over the patch. The value is
+                    # given for every channel, since a lone number would only be applied to the first one.
+                    if coin_flip < 0.5:  # brighter
+                        aug_img_patch = cv2.add(img_patch, (value,) * 4)
                     else:  # dimmer
-                        bright_img_patch = np.where(img_patch < value, 0, img_patch - value)
-
-                    bright_boxes = []
-                    raw_bright_boxes = []
-                    for box in new_boxes:
-                        bright_boxes.append({"all_points_x": [box[0], box[1]],
-                                             "all_points_y": [box[2], box[3]]})
-                        raw_bright_boxes.append([box[0], box[1], box[2], box[3]])
-
-                    # Save patch to disk and store labels
-                    add_patch_to_dataset(bright_img_patch, bright_boxes, raw_bright_boxes, img_name_idx)
-                    img_name_idx += 1
-                else:  # flip (k == 3)
-                    flip_boxes = []
-                    raw_flip_boxes = []
-                    k = np.random.random()
-                    if k < 0.5:
-                        flip_img_patch = np.fliplr(img_patch)
-                        for box in new_boxes:
-                            w = box[1] - box[0]
-                            x_min = self._patch_width - box[1]
-                            x_max = x_min + w
-                            y_min = box[2]
-                            y_max = box[3]
-
-                            flip_boxes.append({"all_points_x": [x_min, x_max],
-                                               "all_points_y": [y_min, y_max]})
-                            raw_flip_boxes.append([x_min, x_max, y_min, y_max])
+                        aug_img_patch = cv2.subtract(img_patch, (value,) * 4)
+                    aug_boxes = patch_boxes
+                else:  # flip (aug == 3)
+                    if coin_flip < 0.5:
+                        aug_img_patch = cv2.flip(img_patch, 1)
+                        aug_boxes = np.stack([patch_width - x_max, patch_width - x_min, y_min, y_max], axis=1)
                     else:
-                        flip_img_patch = np.flipud(img_patch)
-                        for box in new_boxes:
-                            h = box[3] - box[2]
-                            x_min = box[0]
-                            x_max = box[1]
-                            y_min = self._patch_height - box[3]
-                            y_max = y_min + h
-
-                            flip_boxes.append({"all_points_x": [x_min, x_max],
-                                               "all_points_y": [y_min, y_max]})
-                            raw_flip_boxes.append([x_min, x_max, y_min, y_max])
-
-                    # Save patch to disk and store labels
-                    add_patch_to_dataset(flip_img_patch, flip_boxes, raw_flip_boxes, img_name_idx)
-                    img_name_idx += 1
-            self._log(str(i + 1) + '/' + str(self._grid_w * self._grid_h))
-        self._log('Completed augmentation patches. Total images so far: ' + str(img_name_idx))
+                        aug_img_patch = cv2.flip(img_patch, 0)
+                        aug_boxes = np.stack([x_min, x_max, patch_height - y_max, patch_height - y_min], axis=1)
+
+                # Save patch to disk and store labels
+                patches.append((save_patch(aug_img_patch, patch_idx), aug_boxes.tolist(), patch_idx))
+                patch_idx += 1
+
+            return patches
+
+        self._log('Creating augmentation patches...')
+        aug_idx_start = img_name_idx
+        patch_all_images(augmentation_patches)
+        img_name_idx = aug_idx_start + num_orig_images * grid_count
+        self._log('Completed augmentation patches. Total images so far: ' + str(len(new_raw_image_files)))
 
         # Third set of patches: pick patches completely at random so as to double the number of patches in our dataset
-        self._log('Generating random patches...')
-        rand_patches_per_img = img_name_idx // len(self._raw_image_files)
-        for img_num, img_name, img_boxes in zip(range(num_orig_images), self._raw_image_files, self._all_labels):
-            img = np.array(Image.open(img_name))
+        rand_patches_per_img = len(new_raw_image_files) // len(self._raw_image_files)
 
-            for _ in range(rand_patches_per_img):
-                img_patch, img_tblr = get_random_patch(img, self._patch_width, self._patch_height)
-                raw_new_boxes = get_boxes_in_patch(img_tblr, img_boxes)
-                new_boxes = []
-                for box in raw_new_boxes:
-                    new_boxes.append({"all_points_x": box[0:2], "all_points_y": box[2:4]})
+        def random_patches(img_num, img_name, box_xywh, seed):
+            rng = np.random.default_rng(seed)
+            patch_idx = rand_idx_start + img_num * rand_patches_per_img
+            patches = []
+            img = cv2.imread(img_name, cv2.IMREAD_UNCHANGED)
 
-                # Save patch to disk and store labels
-                add_patch_to_dataset(img_patch, new_boxes, raw_new_boxes, img_name_idx)
-                img_name_idx += 1
+            rand_xs, rand_ys = get_random_centres(img, rand_patches_per_img, rng)
+
+            # The patches are all independent, so they're sliced out in order of 64x64 pixel tiles of the image rather
+            # than the order they were drawn in. That way, overlapping patches are read one after another while their
+            # part of the image is still in the cache.
+            tile_order = np.argsort((rand_ys // 64) * (img.shape[1] // 64 + 1) + (rand_xs // 64), kind='stable')
+            rand_xs, rand_ys = rand_xs[tile_order], rand_ys[tile_order]
+            for img_patch, patch_boxes in get_patches_at_centres(img, box_xywh, rand_xs, rand_ys):
+                # Save patch to disk and keep the labels for later
+                patches.append((save_patch(img_patch, patch_idx), patch_boxes.tolist(), patch_idx))
+                patch_idx += 1
 
-            self._log(str(img_num + 1) + '/' + str(num_orig_images))
+            return patches
 
-        # Save all of the patch labels as a JSON file before returning the patch filenames and labels
-        with open(json_file + 'train_patches.json', 'w', encoding='utf-8') as outfile:
-            json.dump(img_dict, outfile)
+        self._log('Generating random patches...')
+        rand_idx_start = img_name_idx
+        patch_all_images(random_patches)
+
+        # Finish off the JSON file of patch labels before returning the patch filenames and labels
+        json_fh.write('}')
+        json_fh.close()
 
         return new_raw_image_files, new_raw_labels
 
@@ -1094,11 +1202,13 @@ class ObjectDetectionModel(DPPModel):
         # scaling image down to the grid size
         scale_ratio_w = self._grid_w / self._image_width
         scale_ratio_h = self._grid_h / self._image_height
+        grid_count = self._grid_w * self._grid_h
+        vec_size = (1 + self._NUM_CLASSES + 4)
 
         labels_with_one_hot = []
         for curr_img_coords in self._all_labels:
-            curr_img_grid_locs = []  # for duplicates; current hacky fix
-            curr_img_labels = np.zeros((self._grid_w * self._grid_h) * (1 + self._NUM_CLASSES + 4))
+            curr_img_grid_locs = set()  # for duplicates; current hacky fix
+            curr_img_labels = np.zeros(grid_count * vec_size)
 
             # only one object per image so no need to loop here
             # add scaled bbox coords
@@ -1109,14 +1219,16 @@ class ObjectDetectionModel(DPPModel):
             y_center = (h / 2) + curr_img_coords[2]
             x_grid = x_center * scale_ratio_w
             y_grid = y_center * scale_ratio_h
-            x_grid_offset, x_grid_loc = np.modf(x_grid)
-            y_grid_offset, y_grid_loc = np.modf(y_grid)
+            x_grid_loc = int(x_grid)
+            y_grid_loc = int(y_grid)
+            x_grid_offset = x_grid - x_grid_loc
+            y_grid_offset = y_grid - y_grid_loc
 
             # for duplicate object in grid checking
             if (x_grid_loc, y_grid_loc) in curr_img_grid_locs:
                 continue
             else:
-                curr_img_grid_locs.append((x_grid_loc, y_grid_loc))
+                curr_img_grid_locs.add((x_grid_loc, y_grid_loc))
 
             # w and h values on grid scale
             w_grid = w * scale_ratio_w
@@ -1132,7 +1244,6 @@ class ObjectDetectionModel(DPPModel):
             # maybe define a new list inside the loop, append a 1, then extend a one-hot list, then append
             # x,y,w,h then use the in this next line below
             # cur_box = []... vec_size = len(currbox)....
-            vec_size = (1 + self._NUM_CLASSES + 4)
             curr_img_labels[int(grid_loc)*vec_size:(int(grid_loc)+1)*vec_size] = \
                 [1, 1, x_grid_offset, y_grid_offset, w_grid, h_grid]
             # using extend because I had trouble with converting a list of lists to a tensor, so making it one list
@@ -1157,50 +1268,45 @@ class ObjectDetectionModel(DPPModel):
         # scaling image down to the grid size
         scale_ratio_w = self._grid_w / self._image_width
         scale_ratio_h = self._grid_h / self._image_height
-
-        labels_with_one_hot = []
-        for curr_img_coords in self._all_labels:
-            curr_img_grid_locs = []  # for duplicates; current hacky fix
-            curr_img_labels = np.zeros((self._grid_w * self._grid_h) * (1 + self._NUM_CLASSES + 4))
-            num_boxes = len(curr_img_coords)
-            for i in range(num_boxes):
-                # add scaled bbox coords
-                # x and y offsets from grid position
-                w = curr_img_coords[i][1] - curr_img_coords[i][0]
-                h = curr_img_coords[i][3] - curr_img_coords[i][2]
-                x_center = (w / 2) + curr_img_coords[i][0]
-                y_center = (h / 2) + curr_img_coords[i][2]
-                x_grid = x_center * scale_ratio_w
-                y_grid = y_center * scale_ratio_h
-                x_grid_offset, x_grid_loc = np.modf(x_grid)
-                y_grid_offset, y_grid_loc = np.modf(y_grid)
-
-                # for duplicate object in grid checking
-                if (x_grid_loc, y_grid_loc) in curr_img_grid_locs:
-                    continue
-                else:
-                    curr_img_grid_locs.append((x_grid_loc, y_grid_loc))
-
-                # w and h values on grid scale
-                w_grid = w * scale_ratio_w
-                h_grid = h * scale_ratio_h
-
-                # compute grid-cell location
-                # grid is defined as left-right, down, left-right, down... so in a 3x3 grid the middle left cell
-                # would be 4 (or 3 when 0-indexing)
-                grid_loc = ((y_grid_loc * self._grid_w) + x_grid_loc) % (self._grid_h * self._grid_w)
-                # the % (self._grid_h*self._grid_w) is to handle the rare case we are right on the edge and
-                # we want the last 0-indexed grid position (off by 1 error, get 49 for 7x7 grid when should have 48)
-
-                # 1 for obj then 1 since only one class <- needs to be made more general for multiple classes #
-                # should be [1,0,...,1,...,0,x,y,w,h] where 0,...,1,...,0 represents the one-hot encoding of classes
-                curr_box = [1, 1, x_grid_offset, y_grid_offset, w_grid, h_grid]
-
-                vec_size = (1 + self._NUM_CLASSES + 4)
-                curr_img_labels[int(grid_loc) * vec_size:(int(grid_loc) + 1) * vec_size] = curr_box
-                # using extend because I had trouble with converting a list of lists to a tensor, so making it one list
-                # of all the numbers and then reshaping later when we pull y off the train shuffle batch has been the
-                # current hacky fix
-            labels_with_one_hot.append(curr_img_labels)
+        grid_count = self._grid_w * self._grid_h
+        vec_size = (1 + self._NUM_CLASSES + 4)
+
+        # Every image's boxes are converted at once as one array of [x_min, x_max, y_min, y_max] rows, keeping track of
+        # which image each box came from
+        num_images = len(self._all_labels)
+        img_idx = np.repeat(np.arange(num_images), [len(curr_img_coords) for curr_img_coords in self._all_labels])
+        all_coords = np.array([box for curr_img_coords in self._all_labels for box in curr_img_coords],
+                              dtype=np.float64).reshape(-1, 4)
+
+        # add scaled bbox coords
+        # x and y offsets from grid position
+        w = all_coords[:, 1] - all_coords[:, 0]
+        h = all_coords[:, 3] - all_coords[:, 2]
+        x_center = (w / 2) + all_coords[:, 0]
+        y_center = (h / 2) + all_coords[:, 2]
+        x_grid_offset, x_grid_loc = np.modf(x_center * scale_ratio_w)
+        y_grid_offset, y_grid_loc = np.modf(y_center * scale_ratio_h)
+
+        # for duplicate object in grid checking; only the first box in an image's grid cell is kept
+        _, first_in_cell = np.unique(np.stack([img_idx, x_grid_loc, y_grid_loc], axis=1), axis=0, return_index=True)
+        keep = np.sort(first_in_cell)
+
+        # compute grid-cell location
+        # grid is defined as left-right, down, left-right, down... so in a 3x3 grid the middle left cell
+        # would be 4 (or 3 when 0-indexing)
+        grid_loc = (((y_grid_loc * self._grid_w) + x_grid_loc) % grid_count).astype(np.int64)
+        # the % grid_count is to handle the rare case we are right on the edge and we want the last 0-indexed grid
+        # position (off by 1 error, get 49 for 7x7 grid when should have 48)
+
+        # 1 for obj then 1 since only one class <- needs to be made more general for multiple classes #
+        # should be [1,0,...,1,...,0,x,y,w,h] where 0,...,1,...,0 represents the one-hot encoding of classes
+        ones = np.ones_like(w)
+        all_boxes = np.stack([ones, ones, x_grid_offset, y_grid_offset, w * scale_ratio_w, h * scale_ratio_h], axis=1)
+
+        # Each image's label is one flat vector of all of the grid cells' box vectors, which gets reshaped later when
+        # we pull y off the train shuffle batch
+        all_img_labels = np.zeros((num_images, grid_count, vec_size))
+        all_img_labels[img_idx[keep], grid_loc[keep]] = all_boxes[keep]
+        labels_with_one_hot = list(all_img_labels.reshape(num_images, grid_count * vec_size))
 
         return labels_with_one_hot
@@ -3,7 +3,6 @@ import numpy as np
 import tensorflow.compat.v1 as tf
 import os
 import warnings
-import copy
 from tqdm import tqdm
 
 
@@ -43,9 +42,9 @@ class RegressionModel(DPPModel):
                 tf.summary.scalar('validation/loss', self._graph_ops['val_cost'],
                                   collections=['custom_summaries'])
                 tf.summary.histogram('validation/batch_losses', self._graph_ops['val_losses'],
-                                     collections=['custom_summaries'])
+                                     collections=['custom_expensive_summaries'])
 
-        self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_merge_summaries()
 
     def _assemble_graph(self):
         with self._graph.as_default():
@@ -68,14 +67,14 @@ class RegressionModel(DPPModel):
 
                 # Batch the datasets and create iterators for them
                 self._train_dataset = self._train_dataset.map(_deserialize_label, num_parallel_calls=self._num_threads)
-                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True)
+                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True, images=True, augment=True)
                 if self._testing:
                     self._test_dataset = self._test_dataset.map(_deserialize_label,
                                                                 num_parallel_calls=self._num_threads)
-                    test_iter = self._batch_and_iterate(self._test_dataset)
+                    test_iter = self._batch_and_iterate(self._test_dataset, images=True)
                 if self._validation:
                     self._val_dataset = self._val_dataset.map(_deserialize_label, num_parallel_calls=self._num_threads)
-                    val_iter = self._batch_and_iterate(self._val_dataset)
+                    val_iter = self._batch_and_iterate(self._val_dataset, images=True)
 
                 if self._has_moderation:
                     train_mod_iter = self._batch_and_iterate(self._train_moderation_features)
@@ -357,7 +356,7 @@ class RegressionModel(DPPModel):
             num_out = output_size
 
         with self._graph.as_default():
-            layer = layers.fullyConnectedLayer('output', copy.deepcopy(self._last_layer().output_size), num_out,
+            layer = layers.fullyConnectedLayer('output', self._last_layer_output_size(), num_out,
                                                reshape, None, self._weight_initializer, regularization_coefficient)
 
         self._log('Inputs: {0} Outputs: {1}'.format(layer.input_size, layer.output_size))
@@ -3,7 +3,6 @@ import numpy as np
 import tensorflow.compat.v1 as tf
 import os
 import warnings
-import copy
 import itertools
 import shutil
 from math import ceil
@@ -47,16 +46,16 @@ class SemanticSegmentationModel(DPPModel):
         # We send in the last layer's output size (i.e. the final image dimensions) to get_weights_as_image
         # because xx and x_test_predicted have dynamic dims [?,?,?,?], so we need actual numbers passed in
 
-        tf.summary.image('masks/train', self._graph_forward_pass, collections=['custom_summaries'])
+        tf.summary.image('masks/train', self._graph_forward_pass, collections=['custom_expensive_summaries'])
 
-        tf.summary.image('masks/target', self._graph_target, collections=['custom_summaries'])
+        tf.summary.image('masks/target', self._graph_target, collections=['custom_expensive_summaries'])
 
-        tf.summary.image('input_image', self._graph_input, collections=['custom_summaries'])
+        tf.summary.image('input_image', self._graph_input, collections=['custom_expensive_summaries'])
 
         if self._validation:
             tf.summary.scalar('validation/loss', self._graph_ops['val_cost'], collections=['custom_summaries'])
 
-        self._graph_ops['merged'] = tf.summary.merge_all(key='custom_summaries')
+        self._graph_merge_summaries()
 
     def _assemble_graph(self):
         with self._graph.as_default():
@@ -67,11 +66,11 @@ class SemanticSegmentationModel(DPPModel):
                 self._graph_parse_data()
 
                 # Batch the datasets and create iterators for them
-                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True)
+                train_iter = self._batch_and_iterate(self._train_dataset, shuffle=True, images=True, augment=True)
                 if self._testing:
-                    test_iter = self._batch_and_iterate(self._test_dataset)
+                    test_iter = self._batch_and_iterate(self._test_dataset, images=True)
                 if self._validation:
-                    val_iter = self._batch_and_iterate(self._val_dataset)
+                    val_iter = self._batch_and_iterate(self._val_dataset, images=True)
 
                 if self._has_moderation:
                     train_mod_iter = self._batch_and_iterate(self._train_moderation_features)
@@ -338,13 +337,13 @@ class SemanticSegmentationModel(DPPModel):
         self._log('Adding output layer...')
 
         if self._num_seg_class == 2:
-            filter_dimension = [1, 1, copy.deepcopy(self._last_layer().output_size[3]), 1]
+            filter_dimension = [1, 1, self._last_layer().output_size[3], 1]
         else:
-            filter_dimension = [1, 1, copy.deepcopy(self._last_layer().output_size[3]), self._num_seg_class]
+            filter_dimension = [1, 1, self._last_layer().output_size[3], self._num_seg_class]
 
         with self._graph.as_default():
             layer = layers.convLayer('output',
-                                     copy.deepcopy(self._last_layer().output_size),
+                                     self._last_layer_output_size(),
                                      filter_dimension,
                                      1,
                                      None,
@@ -417,8 +416,9 @@ class SemanticSegmentationModel(DPPModel):
                 seg_patch = Image.fromarray(self._autopatch_extract_patch(seg, tl_coord, br_coord))
                 im_name = os.path.join(im_dir, 'im_{:0>6d}.png'.format(i))
                 seg_name = os.path.join(seg_dir, 'seg_{:0>6d}.png'.format(i))
-                im_patch.save(im_name)
-                seg_patch.save(seg_name)
+                # Patches are throwaway training data, so a low PNG compression level is worth the much faster encoding
+                im_patch.save(im_name, compress_level=1)
+                seg_patch.save(seg_name, compress_level=1)
                 image_files.append(im_name)
                 seg_files.append(seg_name)
 
@@ -475,20 +475,17 @@ class SemanticSegmentationModel(DPPModel):
         return im_patch
 
     def _parse_apply_preprocessing(self, images, labels):
-        # Apply pre-processing to the image labels too (which are images for semantic segmentation). If there are
-        # multiples classes encoded as 0, 1, 2, ..., we want to maintain the read-in uint8 type and do a simple cast
-        # to float32 instead of a full image type conversion to prevent value scaling.
-        images = self._parse_read_images(images, channels=self._image_depth)
-        if self._num_seg_class > 2:
-            labels = self._parse_read_images(labels, channels=1, image_type=tf.uint8)
-            labels = tf.cast(labels, tf.float32)
-        else:
-            labels = self._parse_read_images(labels, channels=1)
+        # Apply pre-processing to the image labels too (which are images for semantic segmentation). The labels are
+        # decoded to single-channel uint8 masks and stay that way through resizing and cropping; they're only
+        # converted to float32 once their shape is set at the end of the pipeline.
+        images = self._parse_read_images(images, channels=self._image_depth, image_type=tf.uint8)
+        labels = self._parse_read_images(labels, channels=1, image_type=tf.uint8)
         return images, labels
 
     def _parse_resize_images(self, images, labels, height, width):
-        images = tf.image.resize_images(images, [height, width])
-        labels = tf.image.resize_images(labels, [height, width])
+        # Labels are resized with nearest neighbour so that class values don't get blended at region borders
+        images = self._parse_resize(images, height, width)
+        labels = self._parse_resize(labels, height, width, nearest=True)
         return images, labels
 
     def _parse_crop_or_pad(self, images, labels, height, width):
@@ -499,4 +496,12 @@ class SemanticSegmentationModel(DPPModel):
     def _parse_force_set_shape(self, images, labels, height, width, depth):
         images.set_shape([height, width, depth])
         labels.set_shape([height, width, 1])
+
+        # If there are multiples classes encoded as 0, 1, 2, ..., we do a simple cast to float32 instead of a full image
+        # type conversion to prevent value scaling.
+        if labels.dtype == tf.uint8:
+            if self._num_seg_class > 2:
+                labels = tf.cast(labels, tf.float32)
+            else:
+                labels = tf.image.convert_image_dtype(labels, dtype=tf.float32)
         return images, labels
@@ -240,6 +240,27 @@ def test_set_resize_images(model):
         model.set_resize_images("True")
 
 
+def test_set_jpeg_decode_method(model):
+    with pytest.raises(TypeError):
+        model.set_jpeg_decode_method(1)
+    with pytest.raises(ValueError):
+        model.set_jpeg_decode_method('slow')
+    model.set_jpeg_decode_method('Accurate')
+    assert model._jpeg_dct_method == 'INTEGER_ACCURATE'
+    model.set_jpeg_decode_method('fast')
+    assert model._jpeg_dct_method == 'INTEGER_FAST'
+
+
+def test_set_image_caching(model):
+    with pytest.raises(TypeError):
+        model.set_image_caching("True")
+    with pytest.raises(TypeError):
+        model.set_image_caching(True, 5)
+    model.set_image_caching(True, '/tmp')
+    assert model._cache_images is True
+    assert model._cache_dir == '/tmp'
+
+
 def test_set_augmentation_flip_horizontal():
     model1 = dpp.RegressionModel()
     model2 = dpp.SemanticSegmentationModel()
@@ -660,6 +681,25 @@ def test_add_output_layer():
 
 
 # more loading data tests!!!!
+def test_hyperparameter_search_arguments(model):
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='bayes')
+    with pytest.raises(TypeError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random', num_trials=2.0)
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random', num_trials=0)
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='grid', patience=2)
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random', lr_limits=[0.001, 0.01], patience=0)
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random')
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random', l2_reg_limits=[0, 0.01])
+    with pytest.raises(ValueError):
+        model.begin_training_with_hyperparameter_search(search_strategy='random', lr_limits=[0.01, 0.001])
+
+
 def test_load_dataset_from_directory_with_csv_labels(model, test_data_dir):
     im_path = os.path.join(test_data_dir, 'test_dir_csv_labels', '')
     label_path = os.path.join(test_data_dir, 'test_csv_labels.txt')
@@ -129,3 +129,55 @@ def test_get_dir_images():
     assert ims == ['fake_dir/im1.jpg', 'fake_dir/im2.JPG', 'fake_dir/im3.jpeg', 'fake_dir/im4.png']
 
     shutil.rmtree(dir_name)
+
+
+def test_get_dir_files():
+    def make_fake_file(f_name):
+        open(f_name, 'a').close()
+
+    dir_name = os.path.join(os.path.curdir, 'fake_dir')
+    if os.path.exists(dir_name):
+        shutil.rmtree(dir_name)
+
+    # Getting files from an empty directory
+    os.mkdir(dir_name)
+    assert loaders.get_dir_files(dir_name, suffix='.png') == []
+
+    # Getting files by suffix and prefix, ignoring subdirectories
+    make_fake_file(os.path.join(dir_name, 'VIS_SV_0.png'))
+    make_fake_file(os.path.join(dir_name, 'VIS_TV_0.png'))
+    make_fake_file(os.path.join(dir_name, 'labels.csv'))
+    os.mkdir(os.path.join(dir_name, 'patches.png'))
+    png_files = sorted(loaders.get_dir_files('fake_dir', suffix='.png'))
+    assert png_files == ['fake_dir/VIS_SV_0.png', 'fake_dir/VIS_TV_0.png']
+    assert loaders.get_dir_files('fake_dir', prefix='VIS_SV_') == ['fake_dir/VIS_SV_0.png']
+    assert loaders.get_dir_files('fake_dir', suffix='.csv', prefix='VIS') == []
+
+    shutil.rmtree(dir_name)
+
+
+def test_read_csv_rows_after_file_change():
+    csv_file = os.path.join(os.path.curdir, 'changing_csv.csv')
+    with open(csv_file, 'w') as f:
+        f.write('a,1\nb,2\n')
+    assert loaders.read_csv_rows(csv_file) == [['a', '1'], ['b', '2']]
+
+    # Repeat reads should give back fresh lists, and rewriting the file should be picked up
+    loaders.read_csv_rows(csv_file)[0].append('x')
+    assert loaders.read_csv_labels_and_ids(csv_file, 1, 0) == (['1', '2'], ['a', 'b'])
+    # Keep the old modification time, as happens when a file is rewritten within one tick of a coarse file system clock
+    modified_time = os.stat(csv_file).st_mtime_ns
+    with open(csv_file, 'w') as f:
+        f.write('c,3\n')
+    os.utime(csv_file, ns=(modified_time, modified_time))
+    assert loaders.read_csv_rows(csv_file) == [['c', '3']]
+
+    os.remove(csv_file)
+
+
+def test_box_coordinates_to_xywh_array():
+    boxes = [['10', '20', '10', '35', '41', '35', '41', '20'],
+             ['0', '0', '0', '7', '5', '7', '5', '0']]
+    xywh = loaders.box_coordinates_to_xywh_array(boxes)
+    assert np.array_equal(xywh, [loaders.box_coordinates_to_xywh_coordinates(box) for box in boxes])
+    assert loaders.box_coordinates_to_xywh_array([]).shape == (0, 4)